@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+import numpy as np
+
+# Compare the per-call latency of model.predict, model.predict_on_batch and LowLatencyPredictor for batch sizes 1-64
+#   python CNN_code/benchmark_inference.py --model CNN_code/best_gray_chip_model_cate.keras
+# Random 0-255 crops are used, only the inference time is measured (no decoding)
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+
+def time_calls(function, batch, repeats):
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function(batch)
+        timings.append(time.perf_counter() - start_time)
+    return float(np.median(timings)), float(np.percentile(timings, 95))
+
+def run_benchmark(model, batch_sizes=DEFAULT_BATCH_SIZES, repeats=20, warmup=3):
+    from chip_predictor import LowLatencyPredictor
+    start_time = time.perf_counter()
+    predictor = LowLatencyPredictor(model, max_batch_size=max(batch_sizes))
+    setup_seconds = time.perf_counter() - start_time
+
+    methods = {
+        'predict': lambda batch: model.predict(batch, verbose=0),
+        'predict_on_batch': model.predict_on_batch,
+        'low_latency': predictor.predict,
+    }
+    rng = np.random.default_rng(0)
+    results = []
+    for batch_size in batch_sizes:
+        batch = rng.uniform(0, 255, (batch_size,) + predictor.input_shape).astype(np.float32)
+        row = {'batch_size': batch_size}
+        for name, function in methods.items():
+            for _ in range(warmup):
+                function(batch)
+            p50, p95 = time_calls(function, batch, repeats)
+            row[name] = {'p50': p50, 'p95': p95, 'p50_per_image': p50 / batch_size}
+        # Same probabilities from both paths (float32 rounding only)
+        row['max_difference'] = float(np.abs(np.asarray(model.predict_on_batch(batch)) - predictor.predict(batch)).max())
+        results.append(row)
+    return {'setup_seconds': setup_seconds, 'warmup_seconds': predictor.warmup_seconds, 'results': results}
+
+def print_report(report):
+    print(f"LowLatencyPredictor setup {report['setup_seconds'] * 1000:.0f} ms (warmup {report['warmup_seconds'] * 1000:.0f} ms)")
+    print(f"{'batch':>5} {'predict':>12} {'on_batch':>12} {'low_latency':>12} {'per image':>10} {'speedup':>8}")
+    for row in report['results']:
+        speedup = row['predict']['p50'] / row['low_latency']['p50'] if row['low_latency']['p50'] > 0 else 0.0
+        print(f"{row['batch_size']:>5} {row['predict']['p50'] * 1000:>9.2f} ms {row['predict_on_batch']['p50'] * 1000:>9.2f} ms "
+              f"{row['low_latency']['p50'] * 1000:>9.2f} ms {row['low_latency']['p50_per_image'] * 1000:>7.2f} ms {speedup:>7.1f}x")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chip CNN inference paths for batch sizes 1-64.")
+    parser.add_argument('--model', default='CNN_code/best_rgb_chip_model_cate.keras')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument('--repeats', type=int, default=20, help="Timed calls per method and batch size")
+    parser.add_argument('--warmup', type=int, default=3, help="Untimed calls before the timed ones")
+    parser.add_argument('--output', default=None, help="Write the report to this JSON file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Same CPU-only setup as the classify scripts
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    import tensorflow as tf                                     # type: ignore
+    model = tf.keras.models.load_model(args.model)
+
+    report = run_benchmark(model, args.batch_sizes, args.repeats, args.warmup)
+    report.update(model=args.model, created=time.strftime('%Y-%m-%d %H:%M:%S'),
+                  environment={'python': platform.python_version(), 'tensorflow': tf.__version__,
+                               'platform': platform.platform(), 'cpu_count': os.cpu_count()})
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+# Example: python CNN_code/benchmark_inference.py --batch-sizes 1 8 32 --output inference_benchmark.json
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+import tensorflow as tf                                         # type: ignore
+from chip_predictor import IMAGE_SIZE, CHANNELS, list_dataset
+from compile_dataset import is_compiled, load_index, iter_shards
+
+# tf.data input pipeline of the training scripts, replacing ImageDataGenerator.flow_from_directory
+#   training_set, class_indices = make_dataset('dataset/chip_dataset/training_set', 'rgb', training=True)
+#   test_set, _ = make_dataset('dataset/chip_dataset/test_set', 'rgb', class_indices=class_indices)
+#   cnn.fit(training_set, validation_data=test_set, ...)
+# The files are read and decoded in parallel, resized once to 224x224 and cached as uint8 (in memory, or on disk when
+# cache is a file path), so the JPEG decoding only happens in the first epoch. The augmentation runs in the graph on
+# whole batches, and the next batches are prepared while the model trains (prefetch).
+# directory can also be a split compiled by compile_dataset.py, the shards are then read directly (no decoding at all).
+AUTOTUNE = tf.data.AUTOTUNE
+
+# Augmentation of the training scripts (same meaning as the ImageDataGenerator arguments)
+AUGMENTATION = {
+    'shear_range': 0.2,             # degrees, like ImageDataGenerator
+    'zoom_range': 0.2,
+    'horizontal_flip': True,
+    'rotation_range': 40,           # degrees
+    'brightness_range': (0.8, 1.2),
+}
+
+def decode_image(image_path, channels, target_size=IMAGE_SIZE):
+    image = tf.io.decode_image(tf.io.read_file(image_path), channels=channels, expand_animations=False)
+    # Nearest neighbour like flow_from_directory, keeps the uint8 type for a compact cache
+    image = tf.image.resize(image, target_size, method='nearest')
+    image.set_shape(tuple(target_size) + (channels,))
+    return image
+
+# Per image affine matrices (output -> input pixel) for ImageProjectiveTransformV3, rotation @ shear @ zoom around the
+# image centre, composed in the same order as ImageDataGenerator.apply_affine_transform
+def random_affine_transforms(batch_size, height, width, augmentation):
+    def uniform(limit):
+        return tf.random.uniform((batch_size,), -limit, limit)
+    theta = uniform(augmentation['rotation_range'] * math.pi / 180)
+    shear = uniform(augmentation['shear_range'] * math.pi / 180)
+    zoom_low, zoom_high = 1 - augmentation['zoom_range'], 1 + augmentation['zoom_range']
+    zoom_x = tf.random.uniform((batch_size,), zoom_low, zoom_high)
+    zoom_y = tf.random.uniform((batch_size,), zoom_low, zoom_high)
+
+    # A = R(theta) @ S(shear) @ Z(zoom_x, zoom_y), in (x, y) pixel coordinates
+    cos_theta, sin_theta = tf.cos(theta), tf.sin(theta)
+    a00 = cos_theta * zoom_x
+    a01 = (-cos_theta * tf.sin(shear) - sin_theta * tf.cos(shear)) * zoom_y
+    a10 = sin_theta * zoom_x
+    a11 = (-sin_theta * tf.sin(shear) + cos_theta * tf.cos(shear)) * zoom_y
+    center_x, center_y = (width - 1) / 2, (height - 1) / 2
+    offset_x = center_x - a00 * center_x - a01 * center_y
+    offset_y = center_y - a10 * center_x - a11 * center_y
+    zeros = tf.zeros_like(theta)
+    return tf.stack([a00, a01, offset_x, a10, a11, offset_y, zeros, zeros], axis=1)
+
+# Random shear, zoom, flip, rotation and brightness of a float batch (0-255 values)
+def augment_batch(images, augmentation=AUGMENTATION):
+    shape = tf.shape(images)
+    batch_size, height, width = shape[0], shape[1], shape[2]
+    transforms = random_affine_transforms(batch_size, tf.cast(height, tf.float32), tf.cast(width, tf.float32), augmentation)
+    images = tf.raw_ops.ImageProjectiveTransformV3(images=images, transforms=transforms, output_shape=shape[1:3],
+                                                   fill_value=0.0, interpolation='BILINEAR', fill_mode='NEAREST')
+    if augmentation['horizontal_flip']:
+        flip = tf.random.uniform((batch_size, 1, 1, 1)) < 0.5
+        images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+    brightness_low, brightness_high = augmentation['brightness_range']
+    brightness = tf.random.uniform((batch_size, 1, 1, 1), brightness_low, brightness_high)
+    return tf.clip_by_value(images * brightness, 0.0, 255.0)
+
+# (image, label) dataset of a compiled split, the shards are read one at a time in a new random order every epoch
+def compiled_images(directory, color_mode, class_indices=None, training=False, seed=None):
+    index = load_index(directory)
+    if class_indices is not None and class_indices != index['class_indices']:
+        raise ValueError(f"{directory} was compiled with the classes {index['class_indices']}, expected {class_indices}")
+    if tuple(index['image_size']) != tuple(IMAGE_SIZE):
+        raise ValueError(f"{directory} was compiled at {index['image_size']}, expected {list(IMAGE_SIZE)}")
+    rng = np.random.default_rng(seed)
+
+    def shards():
+        order = rng.permutation(len(index['shards'])) if training else None
+        yield from iter_shards(directory, color_mode, index, order)
+
+    signature = (tf.TensorSpec((None,) + tuple(IMAGE_SIZE) + (CHANNELS[color_mode],), tf.uint8),
+                 tf.TensorSpec((None,), tf.int32))
+    dataset = tf.data.Dataset.from_generator(shards, output_signature=signature).unbatch()
+    return dataset, index['class_indices'], index['count']
+
+# Batched dataset of (images, one-hot labels) and its class_indices, images rescaled by 1/255 like the training scripts
+# cache: 'memory', a file path (on-disk cache, reused by later runs) or None, not used for a compiled split
+def make_dataset(directory, color_mode='rgb', batch_size=32, training=False, class_indices=None, cache='memory',
+                 augmentation=AUGMENTATION, seed=None, shuffle_buffer=8192):
+    if is_compiled(directory):
+        dataset, class_indices, count = compiled_images(directory, color_mode, class_indices, training, seed)
+        # Images of different shards are mixed by the shuffle buffer
+        shuffle_buffer = min(shuffle_buffer, count)
+    else:
+        image_paths, labels, class_indices = list_dataset(directory, class_indices)
+        channels = CHANNELS[color_mode]
+        dataset = tf.data.Dataset.from_tensor_slices((image_paths, labels))
+        dataset = dataset.map(lambda image_path, label: (decode_image(image_path, channels), label),
+                              num_parallel_calls=AUTOTUNE)
+        if cache == 'memory':
+            dataset = dataset.cache()
+        elif cache:
+            dataset = dataset.cache(cache)
+        shuffle_buffer = len(image_paths)   # the cached images are small, shuffle over the whole set
+    if training:
+        dataset = dataset.shuffle(max(shuffle_buffer, 1), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+
+    def prepare(images, batch_labels):
+        images = tf.cast(images, tf.float32)
+        if training and augmentation:
+            images = augment_batch(images, augmentation)
+        return images / 255.0, tf.one_hot(batch_labels, len(class_indices))
+
+    dataset = dataset.map(prepare, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+    return dataset, class_indices
+
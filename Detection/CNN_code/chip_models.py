@@ -0,0 +1,31 @@
+import tensorflow as tf                                         # type: ignore
+
+# Compact "lite" chip CNN, selected in the training scripts with DETECTION_CHIP_ARCHITECTURE=lite
+# The standard model flattens a 26x26x128 feature map into Dense(128), about 11M of its parameters sit in that one layer.
+# Here every block is a depthwise-separable convolution with batch normalisation and the classifier reads a global
+# average pooling of the last feature map, about 70k parameters for the same 224x224 input and 3 classes.
+# compare_architectures.py reports parameters, file size, CPU latency and test accuracy of both trained models.
+ARCHITECTURES = ('standard', 'lite')
+
+def separable_block(x, filters, pool=True):
+    x = tf.keras.layers.SeparableConv2D(filters, kernel_size=3, padding='same', use_bias=False)(x)
+    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.ReLU()(x)
+    if pool:
+        x = tf.keras.layers.MaxPool2D(pool_size=(2, 2), strides=2)(x)
+    return x
+
+def build_lite_model(input_shape=(224, 224, 3), classes=3, dropout=0.3):
+    inputs = tf.keras.layers.Input(shape=input_shape)
+    # Plain strided convolution first: a separable convolution saves little on 1 or 3 input channels
+    x = tf.keras.layers.Conv2D(32, kernel_size=3, strides=2, padding='same', use_bias=False)(inputs)
+    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.ReLU()(x)                   # 112x112x32
+    x = separable_block(x, 64)                      # 56x56x64
+    x = separable_block(x, 128)                     # 28x28x128
+    x = separable_block(x, 128)                     # 14x14x128
+    x = separable_block(x, 256, pool=False)         # 14x14x256
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.Dropout(dropout)(x)
+    outputs = tf.keras.layers.Dense(classes, activation='softmax')(x)
+    return tf.keras.Model(inputs, outputs, name='chip_cnn_lite')
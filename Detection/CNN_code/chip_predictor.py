@@ -0,0 +1,271 @@
+import io
+import os
+import time
+import pickle
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Batched inference for the chip CNNs (best_rgb_chip_model_cate.keras / best_gray_chip_model_cate.keras)
+#   class_labels = inverse_class_indices(load_class_indices('CNN_code/chip_rgb_class_indices.pkl'))
+#   predictions = predict_batches(['crop1.jpg', 'crop2.jpg', crop_array], model, class_labels, batch_size=32)
+#   predictions['label'], predictions['confidence'], predictions['probabilities']
+# Sources can be image paths or ndarrays (already in the colour order of the model) from a list or a generator.
+# The crops are decoded in threads, the next batch is decoded while the model runs on the current one.
+IMAGE_SIZE = (224, 224)                         # (height, width) used by the training scripts
+CHANNELS = {'rgb': 3, 'grayscale': 1}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')   # the formats flow_from_directory reads
+
+def load_class_indices(class_indices_path):
+    with open(class_indices_path, 'rb') as f:
+        return pickle.load(f)
+
+# Class labels ordered by model output index, the inverse of the class_indices dict ({'chip': 0, 'empty': 1, ...})
+# so that a predicted index is mapped to its label with one array lookup
+def inverse_class_indices(class_indices):
+    class_labels = [None] * len(class_indices)
+    for class_label, index in class_indices.items():
+        class_labels[index] = class_label
+    return np.array(class_labels)
+
+# (image paths, class indices) of a dataset folder with one subfolder per class, like flow_from_directory reads it
+# (dataset/chip_dataset/training_set/chip/..., /empty/...), class_indices defaults to the sorted subfolder names
+def list_dataset(directory, class_indices=None):
+    if class_indices is None:
+        class_names = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+        class_indices = {class_name: index for index, class_name in enumerate(class_names)}
+    image_paths, labels = [], []
+    for class_name, index in sorted(class_indices.items(), key=lambda item: item[1]):
+        class_dir = os.path.join(directory, class_name)
+        for file_name in sorted(os.listdir(class_dir)):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                image_paths.append(os.path.join(class_dir, file_name))
+                labels.append(index)
+    return image_paths, np.array(labels, dtype=np.int32), class_indices
+
+# One crop as a (224, 224, channels) float32 array, the same as make_prediction does with keras load_img + img_to_array
+# source is an image path, the bytes of an encoded image (e.g. a JPEG received by inference_server.py) or an ndarray
+def load_crop(source, color_mode='rgb', target_size=IMAGE_SIZE):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if isinstance(source, np.ndarray):
+        crop = source if source.ndim == 3 else source[:, :, None]
+        if crop.shape[2] != CHANNELS[color_mode]:
+            raise ValueError(f"Crop with {crop.shape[2]} channels for a {color_mode} model")
+        if crop.shape[:2] != tuple(target_size):
+            import tensorflow as tf                         # type: ignore
+            crop = tf.image.resize(crop, target_size, method='nearest').numpy()
+        return crop.astype(np.float32)
+    from tensorflow.keras.preprocessing import image        # type: ignore
+    return image.img_to_array(image.load_img(source, color_mode=color_mode, target_size=target_size))
+
+# Same gray image as load_img(color_mode='grayscale') from an RGB one, PIL convert('L'):
+# L = (R * 19595 + G * 38470 + B * 7471 + 0x8000) >> 16
+def rgb_to_grayscale(images):
+    images = images.astype(np.uint32)
+    gray = (images[..., 0] * 19595 + images[..., 1] * 38470 + images[..., 2] * 7471 + 0x8000) >> 16
+    return gray.astype(np.uint8)[..., None]
+
+# Structured result of the predictions: one record per crop with its label, class index, confidence and probabilities
+# (extra_fields adds fields, e.g. the stage of a cascade)
+def prediction_dtype(class_labels, extra_fields=()):
+    return np.dtype([('label', class_labels.dtype), ('index', np.int32), ('confidence', np.float32),
+                     ('probabilities', np.float32, (len(class_labels),))] + list(extra_fields))
+
+def predictions_to_records(probabilities, class_labels, extra_fields=()):
+    probabilities = np.asarray(probabilities, dtype=np.float32).reshape(len(probabilities), -1)
+    indices = np.argmax(probabilities, axis=1)
+    records = np.empty(len(probabilities), dtype=prediction_dtype(class_labels, extra_fields))
+    records['label'] = class_labels[indices]
+    records['index'] = indices
+    records['confidence'] = probabilities[np.arange(len(probabilities)), indices]
+    records['probabilities'] = probabilities
+    return records
+
+# Lists of at most batch_size sources, works with generators (only one batch is read ahead)
+def iter_batches(sources, batch_size):
+    iterator = iter(sources)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+# Decoded (n, 224, 224, channels) float32 batches of the sources, decoded in threads one batch ahead of the caller
+# timings['decode_seconds'] adds up the time spent waiting for the decoding
+def decoded_batches(sources, color_mode, batch_size, workers=None, timings=None):
+    with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as executor:
+        batches = iter_batches(sources, batch_size)
+        def submit(batch):
+            return [executor.submit(load_crop, source, color_mode) for source in batch]
+
+        pending = submit(next(batches, []))
+        while pending:
+            start_time = time.perf_counter()
+            batch = np.stack([future.result() for future in pending])
+            if timings is not None:
+                timings['decode_seconds'] = timings.get('decode_seconds', 0.0) + time.perf_counter() - start_time
+            pending = submit(next(batches, []))     # decode the next batch while the model runs on this one
+            yield batch
+
+# Classify many crops with one model call per batch, returns the structured array of predictions in input order
+# model is a loaded Keras model (or anything with predict_on_batch, or a callable returning an array)
+# rescale multiplies the pixels before the call: make_prediction feeds raw 0-255 values (default 1.0)
+# stats (optional dict) receives 'images', 'batches', 'decode_seconds' (time waiting for decoding) and 'predict_seconds'
+def predict_batches(sources, model, class_labels, color_mode='rgb', batch_size=32, workers=None, rescale=1.0, stats=None):
+    predict = getattr(model, 'predict_on_batch', None) or model
+    results = []
+    timings = {'decode_seconds': 0.0}
+    predict_seconds = 0.0
+    for batch in decoded_batches(sources, color_mode, batch_size, workers, timings):
+        if rescale != 1.0:
+            batch *= rescale
+        start_time = time.perf_counter()
+        probabilities = predict(batch)
+        predict_seconds += time.perf_counter() - start_time
+        results.append(predictions_to_records(probabilities, class_labels))
+
+    if stats is not None:
+        stats.update(images=sum(len(records) for records in results), batches=len(results),
+                     decode_seconds=timings['decode_seconds'], predict_seconds=predict_seconds)
+    if not results:
+        return np.empty(0, dtype=prediction_dtype(class_labels))
+    return np.concatenate(results)
+
+# Difference between the two highest probabilities of every row, a low margin means an uncertain prediction
+def probability_margins(probabilities):
+    top_two = np.partition(probabilities, -2, axis=1)[:, -2:]
+    return top_two[:, 1] - top_two[:, 0]
+
+# Median seconds of one predict_on_batch call on a batch of random 0-255 crops (one untimed call first)
+def batch_latency(model, batch_size=32, repeats=20):
+    predict = getattr(model, 'predict_on_batch', None) or model
+    batch = np.random.default_rng(0).uniform(0, 255, (batch_size,) + tuple(model.input_shape[1:])).astype(np.float32)
+    predict(batch)
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        predict(batch)
+        timings.append(time.perf_counter() - start_time)
+    return float(np.median(timings))
+
+# Gray -> RGB cascade: every crop goes through the cheaper grayscale model first, only the crops whose probability margin
+# is below margin_threshold are classified again by the RGB model. The crops are decoded once in RGB, the gray input is
+# computed from it (same values as load_img(color_mode='grayscale')). Both models must use the same class indices.
+# gray_model=None sends every crop to the RGB model (same records, all from stage 1).
+# rescale multiplies the pixels of the RGB model, gray_rescale those of the gray model (None = rescale): each model
+# needs the scale it was trained with, e.g. 1/255 for the lite model (chip_dataset.prepare) and its batch normalisation
+# The records get a 'stage' field: 0 = answered by the gray model, 1 = by the RGB model
+# stats (optional dict) receives 'images', 'gray_exits', 'rgb_exits', 'decode_seconds', 'gray_seconds' and 'rgb_seconds',
+# and the cost next to the escalation rate: 'escalation_rate' (share of the crops sent to the RGB model),
+# 'gray_ms_per_image' (gray model time per crop), 'rgb_ms_per_image' (RGB model time per escalated crop) and
+# 'cascade_ms_per_image' (model time of both stages per crop, to compare with rgb_ms_per_image)
+CASCADE_FIELDS = [('stage', np.int8)]
+
+def predict_cascade(sources, gray_model, rgb_model, class_labels, margin_threshold=0.2, batch_size=32, workers=None,
+                    rescale=1.0, gray_rescale=None, stats=None):
+    gray_predict = None if gray_model is None else getattr(gray_model, 'predict_on_batch', None) or gray_model
+    gray_rescale = rescale if gray_rescale is None else gray_rescale
+    rgb_predict = getattr(rgb_model, 'predict_on_batch', None) or rgb_model
+    results = []
+    timings = {'decode_seconds': 0.0, 'gray_seconds': 0.0, 'rgb_seconds': 0.0}
+    for batch in decoded_batches(sources, 'rgb', batch_size, workers, timings):
+        gray_batch = None if gray_predict is None else rgb_to_grayscale(batch).astype(np.float32)
+        if gray_batch is not None and gray_rescale != 1.0:
+            gray_batch *= gray_rescale
+        if rescale != 1.0:
+            batch *= rescale
+        if gray_predict is None:
+            records = np.empty(len(batch), dtype=prediction_dtype(class_labels, CASCADE_FIELDS))
+            uncertain = np.arange(len(batch))
+        else:
+            start_time = time.perf_counter()
+            probabilities = np.asarray(gray_predict(gray_batch), dtype=np.float32)
+            timings['gray_seconds'] += time.perf_counter() - start_time
+            records = predictions_to_records(probabilities, class_labels, CASCADE_FIELDS)
+            records['stage'] = 0
+            uncertain = np.flatnonzero(probability_margins(probabilities) < margin_threshold)
+        if len(uncertain):
+            start_time = time.perf_counter()
+            rgb_probabilities = rgb_predict(batch[uncertain])
+            timings['rgb_seconds'] += time.perf_counter() - start_time
+            rgb_records = predictions_to_records(rgb_probabilities, class_labels, CASCADE_FIELDS)
+            rgb_records['stage'] = 1
+            records[uncertain] = rgb_records
+        results.append(records)
+
+    if not results:
+        results.append(np.empty(0, dtype=prediction_dtype(class_labels, CASCADE_FIELDS)))
+    predictions = np.concatenate(results)
+    if stats is not None:
+        images = len(predictions)
+        rgb_exits = int(np.count_nonzero(predictions['stage'] == 1))
+        stats.update(images=images, gray_exits=images - rgb_exits, rgb_exits=rgb_exits, **timings)
+        stats.update(escalation_rate=rgb_exits / images if images else 0.0,
+                     gray_ms_per_image=timings['gray_seconds'] * 1000 / images if images else 0.0,
+                     rgb_ms_per_image=timings['rgb_seconds'] * 1000 / rgb_exits if rgb_exits else None,
+                     cascade_ms_per_image=(timings['gray_seconds'] + timings['rgb_seconds']) * 1000 / images if images else 0.0)
+    return predictions
+
+# Test set accuracy of the cascade next to the RGB model alone, and the share of crops where both give the same label
+# (the cascade only saves time if the gray model's confident answers are as good as the RGB model's)
+def evaluate_cascade(image_paths, labels, gray_model, rgb_model, class_labels, margin_threshold=0.2, batch_size=32,
+                     workers=None, rescale=1.0, gray_rescale=None):
+    stats = {}
+    cascade_predictions = predict_cascade(image_paths, gray_model, rgb_model, class_labels, margin_threshold, batch_size,
+                                          workers, rescale, gray_rescale, stats=stats)
+    rgb_predictions = predict_cascade(image_paths, None, rgb_model, class_labels, margin_threshold, batch_size, workers,
+                                      rescale)
+    images = len(labels)
+    return {'test_images': images,
+            'cascade_accuracy': float(np.mean(cascade_predictions['index'] == labels)) if images else None,
+            'rgb_accuracy': float(np.mean(rgb_predictions['index'] == labels)) if images else None,
+            'agreement': float(np.mean(cascade_predictions['index'] == rgb_predictions['index'])) if images else None,
+            'escalation_rate': stats['escalation_rate']}
+
+# Low-latency inference for live use, one crop (or a few) at a time
+#   predictor = LowLatencyPredictor(model, max_batch_size=8)
+#   probabilities = predictor.predict_one(crop)
+# model.predict builds a data adapter and a callback loop on every call (several ms even for one image), here the model
+# is called through a tf.function traced once with a fixed input signature, the crops are copied into a preallocated
+# input buffer and the trace is warmed up when the predictor is created, so the first live crop is not slower
+class LowLatencyPredictor:
+    def __init__(self, model, max_batch_size=1, warmup=True):
+        import tensorflow as tf                             # type: ignore
+        self.model = model
+        self.input_shape = tuple(model.input_shape[1:])
+        self.max_batch_size = max_batch_size
+        self.buffer = np.zeros((max_batch_size,) + self.input_shape, dtype=np.float32)
+        self.lock = threading.Lock()                        # the input buffer is shared, one call at a time
+        # The batch dimension stays None in the signature, so every batch size up to max_batch_size uses the same trace
+        signature = [tf.TensorSpec((None,) + self.input_shape, tf.float32)]
+        self.function = tf.function(lambda batch: model(batch, training=False), input_signature=signature)
+        self.warmup_seconds = 0.0
+        if warmup:
+            start_time = time.perf_counter()
+            self.predict(self.buffer)
+            self.warmup_seconds = time.perf_counter() - start_time
+
+    # Probabilities (classes,) of one (224, 224, channels) crop
+    def predict_one(self, crop):
+        with self.lock:
+            self.buffer[0] = crop
+            return self.function(self.buffer[:1]).numpy()[0]
+
+    # Probabilities (n, classes) of a batch of crops (array or list), in chunks of at most max_batch_size
+    def predict(self, crops):
+        results = []
+        with self.lock:
+            for start in range(0, len(crops), self.max_batch_size):
+                chunk = crops[start:start + self.max_batch_size]
+                count = len(chunk)
+                self.buffer[:count] = chunk
+                results.append(self.function(self.buffer[:count]).numpy())
+        if not results:
+            return np.empty((0,) + tuple(self.model.output_shape[1:]), dtype=np.float32)
+        return np.concatenate(results)
+
+    # Same interface as a Keras model for predict_batches
+    predict_on_batch = predict
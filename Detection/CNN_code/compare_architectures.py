@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from chip_predictor import batch_latency, list_dataset, load_class_indices, inverse_class_indices, predict_batches
+from inference_backend import load_model
+from model_registry import MODEL_PATHS
+
+# Compare trained chip CNNs (by default the standard and the lite model of a colour mode)
+#   python CNN_code/compare_architectures.py --color-mode rgb
+# For every model: parameter count, model file size, load time, CPU latency at batch 1 and 32 and test accuracy.
+LATENCY_BATCH_SIZES = (1, 32)
+
+def default_models(color_mode):
+    standard_path = MODEL_PATHS[color_mode][0]
+    return [standard_path, standard_path.replace('_cate.keras', '_lite.keras')]
+
+def is_lite_model(model_path):
+    return os.path.splitext(os.path.basename(model_path))[0].endswith('_lite')
+
+def evaluate_model(model_path, image_paths, labels, class_labels, color_mode, rescale=1.0):
+    start_time = time.perf_counter()
+    model = load_model(model_path)
+    load_seconds = time.perf_counter() - start_time
+    result = {'model': model_path, 'file_bytes': os.path.getsize(model_path), 'load_seconds': load_seconds,
+              'rescale': rescale}
+    if hasattr(model, 'count_params'):
+        result['parameters'] = int(model.count_params())
+    for batch_size in LATENCY_BATCH_SIZES:
+        result[f'latency_batch_{batch_size}'] = batch_latency(model, batch_size)
+    predictions = predict_batches(image_paths, model, class_labels, color_mode, rescale=rescale)
+    result['test_accuracy'] = float(np.mean(predictions['index'] == labels)) if len(labels) else None
+    return result
+
+def print_report(report):
+    print(f"{report['test_images']} test images, colour mode {report['color_mode']}")
+    print(f"{'model':<45} {'params':>10} {'size MB':>8} {'load s':>7} {'batch 1':>9} {'batch 32':>9} {'accuracy':>9}")
+    for result in report['models']:
+        parameters = f"{result['parameters']:,}" if 'parameters' in result else '-'
+        accuracy = f"{result['test_accuracy']:.2%}" if result['test_accuracy'] is not None else '-'
+        print(f"{os.path.basename(result['model']):<45} {parameters:>10} {result['file_bytes'] / 1e6:>8.2f} "
+              f"{result['load_seconds']:>7.2f} {result['latency_batch_1'] * 1000:>6.1f} ms "
+              f"{result['latency_batch_32'] * 1000:>6.1f} ms {accuracy:>9}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the standard and lite chip CNNs: size, CPU latency and test accuracy.")
+    parser.add_argument('--color-mode', choices=sorted(MODEL_PATHS), default='rgb')
+    parser.add_argument('--models', nargs='+', default=None, help="Trained models (default: the standard and the lite model of the colour mode)")
+    parser.add_argument('--class-indices', default=None, help="Class indices .pkl (default: the one of the colour mode)")
+    parser.add_argument('--test-dir', default='dataset/chip_dataset/test_set')
+    parser.add_argument('--rescale', type=float, default=1.0, help="Pixel scale before the models (1.0 = make_prediction, 1/255 = training scale)")
+    parser.add_argument('--lite-rescale', type=float, default=1 / 255,
+                        help="Pixel scale before the lite models (*_lite.*), trained on 1/255 pixels with batch normalisation")
+    parser.add_argument('--output', default=None, help="Write the report to this JSON file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    model_paths = args.models or default_models(args.color_mode)
+    missing = [model_path for model_path in model_paths if not os.path.exists(model_path)]
+    if missing:
+        print(f"Error: missing models {missing} (train the lite model with DETECTION_CHIP_ARCHITECTURE=lite)")
+        return 1
+    class_indices = load_class_indices(args.class_indices or MODEL_PATHS[args.color_mode][1])
+    image_paths, labels, _ = list_dataset(args.test_dir, class_indices)
+    class_labels = inverse_class_indices(class_indices)
+
+    report = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'color_mode': args.color_mode, 'test_images': len(image_paths),
+              'rescale': args.rescale, 'lite_rescale': args.lite_rescale,
+              'models': [evaluate_model(model_path, image_paths, labels, class_labels, args.color_mode,
+                                        args.lite_rescale if is_lite_model(model_path) else args.rescale)
+                         for model_path in model_paths]}
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+# Example: DETECTION_CHIP_ARCHITECTURE=lite python CNN_code/train_CNN_cate_RGB.py, then python CNN_code/compare_architectures.py
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from chip_predictor import IMAGE_SIZE, list_dataset, rgb_to_grayscale
+
+# Compile the chip dataset once into 224x224 uint8 .npy shards, read by make_dataset instead of the JPEG folders
+#   python CNN_code/compile_dataset.py --source dataset/chip_dataset --output dataset/chip_dataset_compiled
+# Every split (training_set, test_set) gets its own folder:
+#   index.json            class_indices, image size, colour modes and the list of shards
+#   labels-00000.npy      class index of every image of the shard (int32)
+#   rgb-00000.npy         (count, 224, 224, 3) uint8
+#   grayscale-00000.npy   (count, 224, 224, 1) uint8
+# Every file is decoded once for both colour modes, the gray image is computed from the RGB one with the same luma
+# formula as PIL (chip_predictor.rgb_to_grayscale), so the gray and RGB trainings share one compilation.
+# The files are decoded with OpenCV, compiling does not need TensorFlow (the training scripts still do).
+INDEX_FILE = 'index.json'
+COLOR_MODES = ('rgb', 'grayscale')
+SHARD_FILE = re.compile(r'^(labels|%s)-\d{5}\.npy$' % '|'.join(COLOR_MODES))
+SPLITS = ('training_set', 'test_set')
+
+# Same (224, 224, 3) RGB pixels as keras load_img(target_size=IMAGE_SIZE): the EXIF orientation is ignored like PIL does
+# and INTER_NEAREST_EXACT picks the same source pixels as the PIL nearest resize used by load_img
+# (the JPEG decoders of OpenCV and PIL can still differ by a grey level on some pixels)
+def decode_rgb(image_path):
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError(f"Cannot decode {image_path}")
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if image.shape[:2] != tuple(IMAGE_SIZE):
+        image = cv2.resize(image, (IMAGE_SIZE[1], IMAGE_SIZE[0]), interpolation=cv2.INTER_NEAREST_EXACT)
+    return image
+
+# Decode one split folder into shards of at most shard_size images, returns the index
+def compile_split(source_dir, output_dir, color_modes=COLOR_MODES, shard_size=2048, class_indices=None, workers=None):
+    image_paths, labels, class_indices = list_dataset(source_dir, class_indices)
+    os.makedirs(output_dir, exist_ok=True)
+    # Recompiling: remove the old index first (the split reads as not compiled until the new one is written), then the
+    # old shards, so a smaller recompilation leaves no shard of the previous one behind
+    index_path = os.path.join(output_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    for file_name in os.listdir(output_dir):
+        if SHARD_FILE.match(file_name):
+            os.remove(os.path.join(output_dir, file_name))
+    shards = []
+    with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as executor:
+        for start in range(0, len(image_paths), shard_size):
+            number = len(shards)
+            images = np.stack(list(executor.map(decode_rgb, image_paths[start:start + shard_size])))
+            shard = {'count': len(images), 'labels': f"labels-{number:05d}.npy"}
+            np.save(os.path.join(output_dir, shard['labels']), labels[start:start + shard_size])
+            for color_mode in color_modes:
+                shard[color_mode] = f"{color_mode}-{number:05d}.npy"
+                np.save(os.path.join(output_dir, shard[color_mode]),
+                        images if color_mode == 'rgb' else rgb_to_grayscale(images))
+            shards.append(shard)
+            print(f"{output_dir}: {start + len(images)}/{len(image_paths)} images")
+
+    index = {'version': 1, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'source': os.path.abspath(source_dir),
+             'image_size': list(IMAGE_SIZE), 'color_modes': list(color_modes), 'class_indices': class_indices,
+             'count': len(image_paths), 'shards': shards}
+    # The index is written last (and moved in place complete), so an interrupted compilation is never read
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    os.replace(index_path + '.tmp', index_path)
+    return index
+
+def is_compiled(directory):
+    return os.path.isfile(os.path.join(directory, INDEX_FILE))
+
+# Folder the training scripts read: the compiled dataset when every split of it is compiled, else the image folders
+def dataset_root(source_dir='dataset/chip_dataset', compiled_dir='dataset/chip_dataset_compiled', splits=SPLITS):
+    if all(is_compiled(os.path.join(compiled_dir, split)) for split in splits):
+        return compiled_dir
+    return source_dir
+
+def load_index(directory):
+    with open(os.path.join(directory, INDEX_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+# (images, labels) of every shard of a colour mode, the images are memory-mapped (read from the page cache, not copied)
+def iter_shards(directory, color_mode, index=None, order=None):
+    index = index or load_index(directory)
+    if color_mode not in index['color_modes']:
+        raise ValueError(f"{directory} was compiled without {color_mode} images ({index['color_modes']})")
+    shards = index['shards'] if order is None else [index['shards'][number] for number in order]
+    for shard in shards:
+        yield (np.load(os.path.join(directory, shard[color_mode]), mmap_mode='r'),
+               np.load(os.path.join(directory, shard['labels'])))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the chip dataset into 224x224 .npy shards for the training scripts.")
+    parser.add_argument('--source', default='dataset/chip_dataset', help="Folder holding the split folders (one subfolder per class)")
+    parser.add_argument('--output', default='dataset/chip_dataset_compiled')
+    parser.add_argument('--splits', nargs='+', default=list(SPLITS), help="The first split sets the class indices")
+    parser.add_argument('--color-modes', nargs='+', choices=COLOR_MODES, default=list(COLOR_MODES))
+    parser.add_argument('--shard-size', type=int, default=2048, help="Images per shard")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Decoding threads")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_time = time.time()
+    class_indices = None
+    for split in args.splits:
+        index = compile_split(os.path.join(args.source, split), os.path.join(args.output, split), args.color_modes,
+                              args.shard_size, class_indices, args.workers)
+        class_indices = index['class_indices']
+        print(f"{split}: {index['count']} images in {len(index['shards'])} shards, classes {class_indices}")
+    print(f"Compiled in {time.time() - start_time:.2f} seconds to {args.output}")
+    return 0
+
+# Example: python CNN_code/compile_dataset.py, then the training scripts read dataset/chip_dataset_compiled
+if __name__ == "__main__":
+    sys.exit(main())
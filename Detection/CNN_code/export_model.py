@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from chip_predictor import list_dataset, load_crop, load_class_indices, inverse_class_indices, predict_batches
+from inference_backend import load_model
+from model_registry import MODEL_PATHS
+
+# Export a trained chip CNN to TFLite or ONNX for CPU-only inspection PCs, optionally quantized
+#   python CNN_code/export_model.py --color-mode grayscale --format tflite --quantization int8
+# Quantization:
+#   none    -> float32 weights and activations
+#   dynamic -> int8 weights, float activations (no calibration data needed)
+#   int8    -> int8 weights and activations, calibrated on a sample of the training crops
+# The exported model is compared with the Keras model on the test set, the report (accuracy delta, agreement, latency,
+# file size) is printed and written next to the exported file, to decide per station which model to run.
+# The crops are fed as raw 0-255 values, the same as make_prediction.
+QUANTIZATIONS = ('none', 'dynamic', 'int8')
+FORMATS = ('tflite', 'onnx')
+
+# Random sample of training crops (as float32 arrays) for the int8 calibration
+def calibration_crops(dataset_dir, color_mode, samples, seed=0):
+    image_paths, _, _ = list_dataset(dataset_dir)
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(len(image_paths), size=min(samples, len(image_paths)), replace=False)
+    return [load_crop(image_paths[index], color_mode) for index in chosen]
+
+def export_tflite(model, output_path, quantization, crops=None):
+    import tensorflow as tf                                     # type: ignore
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        def representative_dataset():
+            for crop in crops:
+                yield [crop[None]]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8   # 0-255 pixels map exactly to uint8, the output stays float32
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+def export_onnx(model, output_path, quantization, crops=None):
+    import tensorflow as tf                                     # type: ignore
+    import tf2onnx                                              # type: ignore
+    signature = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input')]
+    float_path = output_path if quantization == 'none' else output_path + '.float.onnx'
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=float_path)
+    if quantization == 'none':
+        return
+    from onnxruntime import quantization as onnx_quantization  # type: ignore
+    if quantization == 'dynamic':
+        onnx_quantization.quantize_dynamic(float_path, output_path, weight_type=onnx_quantization.QuantType.QInt8)
+    else:
+        class CropReader(onnx_quantization.CalibrationDataReader):
+            def __init__(self):
+                self.crops = iter(crops)
+            def get_next(self):
+                crop = next(self.crops, None)
+                return None if crop is None else {'input': crop[None]}
+        onnx_quantization.quantize_static(float_path, output_path, CropReader(),
+                                          activation_type=onnx_quantization.QuantType.QInt8,
+                                          weight_type=onnx_quantization.QuantType.QInt8)
+    os.remove(float_path)
+
+# Median single crop latency of a model (seconds)
+def single_crop_latency(model, crop, repeats=50):
+    batch = crop[None]
+    model.predict_on_batch(batch)
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        model.predict_on_batch(batch)
+        timings.append(time.perf_counter() - start_time)
+    return float(np.median(timings))
+
+# Accuracy of both models on the test set, how often they agree, and their latency and file size
+def compare_models(keras_model, exported_model, keras_path, exported_path, test_dir, class_indices, color_mode):
+    image_paths, labels, _ = list_dataset(test_dir, class_indices)
+    class_labels = inverse_class_indices(class_indices)
+    keras_predictions = predict_batches(image_paths, keras_model, class_labels, color_mode)
+    exported_predictions = predict_batches(image_paths, exported_model, class_labels, color_mode)
+    keras_accuracy = float(np.mean(keras_predictions['index'] == labels)) if len(labels) else 0.0
+    exported_accuracy = float(np.mean(exported_predictions['index'] == labels)) if len(labels) else 0.0
+    crop = load_crop(image_paths[0], color_mode) if image_paths else \
+        np.zeros(tuple(keras_model.input_shape[1:]), dtype=np.float32)
+    return {
+        'test_images': len(image_paths),
+        'keras_accuracy': keras_accuracy,
+        'exported_accuracy': exported_accuracy,
+        'accuracy_delta': exported_accuracy - keras_accuracy,
+        'agreement': float(np.mean(keras_predictions['index'] == exported_predictions['index'])) if len(labels) else 0.0,
+        'max_probability_difference': float(np.abs(keras_predictions['probabilities'] -
+                                                   exported_predictions['probabilities']).max()) if len(labels) else 0.0,
+        'keras_latency': single_crop_latency(keras_model, crop),
+        'exported_latency': single_crop_latency(exported_model, crop),
+        'keras_file_bytes': os.path.getsize(keras_path),
+        'exported_file_bytes': os.path.getsize(exported_path),
+    }
+
+def print_report(report):
+    comparison = report['comparison']
+    print(f"Exported {report['model']} -> {report['output']} ({report['format']}, quantization {report['quantization']})")
+    print(f"  size     {comparison['keras_file_bytes'] / 1e6:8.2f} MB -> {comparison['exported_file_bytes'] / 1e6:8.2f} MB")
+    print(f"  latency  {comparison['keras_latency'] * 1000:8.2f} ms -> {comparison['exported_latency'] * 1000:8.2f} ms (batch 1)")
+    print(f"  accuracy {comparison['keras_accuracy']:8.2%}    -> {comparison['exported_accuracy']:8.2%}    "
+          f"(delta {comparison['accuracy_delta'] * 100:+.2f} points, agreement {comparison['agreement']:.2%}, "
+          f"{comparison['test_images']} test images)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the chip CNN to TFLite or ONNX, quantize it and compare it with the Keras model.")
+    parser.add_argument('--color-mode', choices=sorted(MODEL_PATHS), default='rgb')
+    parser.add_argument('--model', default=None, help="Keras model (default: the model of the colour mode)")
+    parser.add_argument('--class-indices', default=None, help="Class indices .pkl (default: the one of the colour mode)")
+    parser.add_argument('--format', choices=FORMATS, default='tflite')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default='dynamic')
+    parser.add_argument('--output', default=None, help="Exported file (default: next to the model, e.g. best_rgb_chip_model_cate.int8.tflite)")
+    parser.add_argument('--calibration-dir', default='dataset/chip_dataset/training_set', help="Crops for the int8 calibration")
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--test-dir', default='dataset/chip_dataset/test_set', help="Crops for the accuracy comparison")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    default_model_path, default_class_indices_path = MODEL_PATHS[args.color_mode]
+    model_path = args.model or default_model_path
+    class_indices = load_class_indices(args.class_indices or default_class_indices_path)
+    output_path = args.output or f"{os.path.splitext(model_path)[0]}.{args.quantization}.{args.format}"
+
+    keras_model = load_model(model_path)
+    crops = None
+    if args.quantization == 'int8':
+        crops = calibration_crops(args.calibration_dir, args.color_mode, args.calibration_samples)
+    start_time = time.perf_counter()
+    if args.format == 'tflite':
+        export_tflite(keras_model, output_path, args.quantization, crops)
+    else:
+        export_onnx(keras_model, output_path, args.quantization, crops)
+    export_seconds = time.perf_counter() - start_time
+
+    report = {'model': model_path, 'output': output_path, 'format': args.format, 'quantization': args.quantization,
+              'color_mode': args.color_mode, 'export_seconds': export_seconds,
+              'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'comparison': compare_models(keras_model, load_model(output_path), model_path, output_path, args.test_dir,
+                                           class_indices, args.color_mode)}
+    print_report(report)
+    with open(os.path.splitext(output_path)[0] + '.report.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return 0
+
+# Example: python CNN_code/export_model.py --color-mode rgb --format tflite --quantization int8,
+# then DETECTION_RGB_MODEL=CNN_code/best_rgb_chip_model_cate.int8.tflite on the station to use it
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import os
+import threading
+
+import numpy as np
+
+# CPU inference backends of the chip CNN, selected by the extension of the model file
+#   .keras / .h5 -> Keras (TensorFlow)
+#   .tflite      -> TFLite interpreter (tflite_runtime when installed, so a station does not need the full TensorFlow)
+#   .onnx        -> ONNX Runtime (optional onnxruntime package)
+# Every backend has input_shape and predict_on_batch(batch) like a Keras model, so predict_batches, the model registry
+# and the classify scripts work with any of them. export_model.py writes the .tflite and .onnx files.
+BACKENDS = {'.keras': 'keras', '.h5': 'keras', '.tflite': 'tflite', '.onnx': 'onnx'}
+
+def backend_name(model_path):
+    extension = os.path.splitext(model_path)[1].lower()
+    if extension not in BACKENDS:
+        raise ValueError(f"Unknown model format {extension!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[extension]
+
+# Quantize a float batch to the integer input type of a quantized model
+def quantize(batch, dtype, scale, zero_point):
+    info = np.iinfo(dtype)
+    return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+class TFLiteModel:
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter      # type: ignore
+        except ImportError:
+            import tensorflow as tf                                 # type: ignore
+            Interpreter = tf.lite.Interpreter
+        self.model_path = model_path
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(int(size) for size in self.input_details['shape'][1:])
+        self.output_shape = (None,) + tuple(int(size) for size in self.output_details['shape'][1:])
+        self.batch_size = int(self.input_details['shape'][0])
+        self.lock = threading.Lock()        # an interpreter runs one call at a time, the registry shares it between threads
+
+    def predict_on_batch(self, batch):
+        with self.lock:
+            return self.invoke(np.asarray(batch, dtype=np.float32))
+
+    def invoke(self, batch):
+        # The interpreter keeps its tensors between calls, they are only reallocated when the batch size changes
+        if len(batch) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_details['index'], (len(batch),) + self.input_shape[1:])
+            self.interpreter.allocate_tensors()
+            self.input_details = self.interpreter.get_input_details()[0]
+            self.output_details = self.interpreter.get_output_details()[0]
+            self.batch_size = len(batch)
+        input_type = self.input_details['dtype']
+        if input_type != np.float32:
+            scale, zero_point = self.input_details['quantization']
+            batch = quantize(batch, input_type, scale, zero_point)
+        self.interpreter.set_tensor(self.input_details['index'], batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output_details['index'])
+        if output.dtype != np.float32:
+            scale, zero_point = self.output_details['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    predict = predict_on_batch      # make_prediction calls model.predict
+
+class OnnxModel:
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime                                          # type: ignore
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.model_path = model_path
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        model_input, model_output = self.session.get_inputs()[0], self.session.get_outputs()[0]
+        self.input_name = model_input.name
+        self.input_shape = (None,) + tuple(model_input.shape[1:])
+        self.output_shape = (None,) + tuple(model_output.shape[1:])
+
+    def predict_on_batch(self, batch):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+    predict = predict_on_batch
+
+# Load a model file with the backend of its extension
+def load_model(model_path, num_threads=None):
+    backend = backend_name(model_path)
+    if backend == 'tflite':
+        return TFLiteModel(model_path, num_threads)
+    if backend == 'onnx':
+        return OnnxModel(model_path, num_threads)
+    import tensorflow as tf                                         # type: ignore
+    return tf.keras.models.load_model(model_path)
@@ -0,0 +1,209 @@
+import io
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import collections
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from chip_predictor import load_crop, predictions_to_records
+from model_registry import MODEL_PATHS, get_model, registry_stats
+
+# Local chip CNN inference service, the models are loaded once and shared by every station on the PC
+#   python CNN_code/inference_server.py --port 8765
+#   POST /predict?model=rgb       body: encoded image (JPEG/PNG) or a .npy crop -> {"label": ..., "confidence": ...}
+#                                 400 if the body cannot be decoded, 500 if the model failed, 503 on timeout
+#   GET  /metrics                 queue depth, batch sizes and latency of every model, load time and memory
+#   GET  /health
+# The requests are served by one thread each (decoding in parallel), the crops of a model go through a DynamicBatcher
+# that runs one model call for all the crops waiting, at most max_batch_size of them, waiting at most max_wait_ms
+# for more crops after the first one.
+LATENCY_WINDOW = 1000       # latencies kept for the metrics percentiles
+REQUEST_TIMEOUT = 30        # seconds a request waits for its prediction before a 503
+
+class DynamicBatcher:
+    def __init__(self, chip_model, max_batch_size=32, max_wait_ms=5.0):
+        self.chip_model = chip_model
+        self.predictor = chip_model.low_latency(max_batch_size)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.batch_sizes = collections.deque(maxlen=LATENCY_WINDOW)
+        self.counters = {'requests': 0, 'batches': 0, 'errors': 0}
+        self.thread = threading.Thread(target=self.run, name=f"batcher-{chip_model.color_mode}", daemon=True)
+        self.thread.start()
+
+    # Queue one (224, 224, channels) crop, the Future gives its prediction record
+    def submit(self, crop):
+        future = Future()
+        self.requests.put((crop, future, time.perf_counter()))
+        return future
+
+    def predict(self, crop, timeout=None):
+        return self.submit(crop).result(timeout)
+
+    # Wait for the first crop, then collect more until the batch is full or max_wait has passed
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                probabilities = self.predictor.predict_on_batch(np.stack([crop for crop, _, _ in batch]))
+                records = predictions_to_records(probabilities, self.chip_model.class_labels)
+            except Exception as error:
+                with self.lock:
+                    self.counters['errors'] += len(batch)
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            now = time.perf_counter()
+            with self.lock:
+                self.counters['requests'] += len(batch)
+                self.counters['batches'] += 1
+                self.batch_sizes.append(len(batch))
+                self.latencies.extend(now - queued_time for _, _, queued_time in batch)
+            for record, (_, future, _) in zip(records, batch):
+                future.set_result(record)
+
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = np.array(self.batch_sizes)
+            metrics = dict(self.counters)
+        metrics.update(queue_depth=self.requests.qsize(), max_batch_size=self.max_batch_size,
+                       max_wait_ms=self.max_wait * 1000)
+        if len(latencies):
+            metrics.update(latency_p50_ms=float(np.percentile(latencies, 50)),
+                           latency_p95_ms=float(np.percentile(latencies, 95)),
+                           mean_batch_size=float(batch_sizes.mean()))
+        return metrics
+
+# JSON friendly prediction record
+def record_to_dict(record):
+    return {'label': str(record['label']), 'index': int(record['index']), 'confidence': float(record['confidence']),
+            'probabilities': record['probabilities'].tolist()}
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    batchers = {}       # colour mode -> DynamicBatcher, set by serve()
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/health':
+            self.send_json(200, {'status': 'ok', 'models': sorted(self.batchers)})
+        elif path == '/metrics':
+            self.send_json(200, {'models': {color_mode: batcher.metrics() for color_mode, batcher in self.batchers.items()},
+                                 'registry': registry_stats()})
+        else:
+            self.send_json(404, {'error': f"Unknown path {path}"})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/predict':
+            self.send_json(404, {'error': f"Unknown path {url.path}"})
+            return
+        color_mode = urllib.parse.parse_qs(url.query).get('model', ['rgb'])[0]
+        if color_mode not in self.batchers:
+            self.send_json(400, {'error': f"Model {color_mode!r} is not served ({sorted(self.batchers)})"})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        start_time = time.perf_counter()
+        try:
+            # .npy crops (already decoded by the client) start with the NumPy magic string
+            source = np.load(io.BytesIO(body)) if body.startswith(b'\x93NUMPY') else body
+            crop = load_crop(source, color_mode)
+        except Exception as error:          # the request is at fault: not an image, wrong channels...
+            self.send_json(400, {'error': f"Cannot decode the crop: {error}"})
+            return
+        try:
+            record = self.batchers[color_mode].predict(crop, timeout=REQUEST_TIMEOUT)
+        except FutureTimeoutError:          # the batcher is overloaded or stuck, the client can retry later
+            self.send_json(503, {'error': f"No prediction within {REQUEST_TIMEOUT} s"})
+            return
+        except Exception as error:          # the model call failed, the server is at fault
+            self.send_json(500, {'error': f"Prediction failed: {error}"})
+            return
+        result = record_to_dict(record)
+        result['server_ms'] = (time.perf_counter() - start_time) * 1000
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass                # one line per crop would flood the console
+
+# Load the models and serve until interrupted
+def serve(host='127.0.0.1', port=8765, color_modes=('rgb',), max_batch_size=32, max_wait_ms=5.0):
+    InferenceHandler.batchers = {}
+    for color_mode in color_modes:
+        chip_model = get_model(color_mode)
+        chip_model.warmup()
+        InferenceHandler.batchers[color_mode] = DynamicBatcher(chip_model, max_batch_size, max_wait_ms)
+        print(f"Serving {chip_model.model_path} ({color_mode}, loaded in {chip_model.load_seconds:.2f} s)")
+    server = ThreadingHTTPServer((host, port), InferenceHandler)
+    server.daemon_threads = True
+    print(f"Listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# Client side: classify one crop (image path, encoded bytes or ndarray) with a running server, returns the result dict
+def classify_remote(source, color_mode='rgb', url='http://127.0.0.1:8765', timeout=30):
+    if isinstance(source, np.ndarray):
+        buffer = io.BytesIO()
+        np.save(buffer, source)
+        body = buffer.getvalue()
+    elif isinstance(source, (bytes, bytearray)):
+        body = bytes(source)
+    else:
+        with open(source, 'rb') as f:
+            body = f.read()
+    request = urllib.request.Request(f"{url}/predict?model={urllib.parse.quote(color_mode)}", data=body,
+                                     headers={'Content-Type': 'application/octet-stream'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the chip CNNs over HTTP with dynamic batching.")
+    parser.add_argument('--host', default='127.0.0.1', help="127.0.0.1 keeps the service local to this PC")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--models', nargs='+', choices=sorted(MODEL_PATHS), default=['rgb'], help="Colour modes to serve")
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="Time to wait for more crops after the first one")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    serve(args.host, args.port, args.models, args.max_batch_size, args.max_wait_ms)
+    return 0
+
+# Example: python CNN_code/inference_server.py --models rgb grayscale,
+# then from a station: classify_remote('crop.jpg', 'rgb') or curl --data-binary @crop.jpg "http://127.0.0.1:8765/predict?model=rgb"
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import threading
+
+import numpy as np
+from chip_predictor import load_class_indices, inverse_class_indices
+from inference_backend import backend_name, load_model
+
+try:
+    import resource     # Not available on Windows, the peak RSS is then not reported
+except ImportError:
+    resource = None
+
+# Lazy, shared chip CNN models
+#   chip_model = get_model('rgb')          # loaded on the first call, the same instance for every caller afterwards
+#   chip_model.model, chip_model.class_labels, chip_model.load_seconds
+#   warmup_in_background('grayscale')      # load (and run one prediction) in a thread while the station starts
+# Importing this module does not import TensorFlow, the first get_model does.
+# Paths are relative to the Detection folder like in the classify scripts.
+# The backend follows the model file (.keras, .tflite or .onnx, see inference_backend.py), a station selects an exported
+# model with DETECTION_RGB_MODEL / DETECTION_GRAY_MODEL without changing the callers.
+MODEL_PATHS = {
+    'rgb': (os.environ.get('DETECTION_RGB_MODEL', 'CNN_code/best_rgb_chip_model_cate.keras'), 'CNN_code/chip_rgb_class_indices.pkl'),
+    'grayscale': (os.environ.get('DETECTION_GRAY_MODEL', 'CNN_code/best_gray_chip_model_cate.keras'), 'CNN_code/chip_gray_class_indices.pkl'),
+}
+
+class ChipModel:
+    def __init__(self, model_path, class_indices_path, color_mode, generation=0):
+        self.model_path = model_path
+        self.class_indices_path = class_indices_path
+        self.color_mode = color_mode
+        start_time = time.perf_counter()
+        # Same CPU-only setup as the classify scripts, only applied before TensorFlow is imported
+        os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+        os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+        self.backend = backend_name(model_path)
+        self.model = load_model(model_path)
+        self.class_indices = load_class_indices(class_indices_path)
+        self.class_labels = inverse_class_indices(self.class_indices)
+        self.load_seconds = time.perf_counter() - start_time
+        self.warmup_seconds = None
+        self.low_latency_predictor = None
+        # Identity of the loaded weights for the prediction cache: a retrained model file (other size or modification
+        # time) or other class indices give another identity, and so does every reload (generation = number of earlier
+        # loads of this model in the process), even when the file looks the same
+        stat = os.stat(model_path)
+        self.generation = generation
+        self.identity = (f"{os.path.abspath(model_path)}|{stat.st_size}|{stat.st_mtime_ns}|{color_mode}|"
+                         f"{sorted(self.class_indices.items())}|{generation}")
+
+    # One prediction on a blank crop so that the first real crop does not pay for the graph setup
+    def warmup(self):
+        start_time = time.perf_counter()
+        self.model.predict_on_batch(np.zeros((1,) + tuple(self.model.input_shape[1:]), dtype=np.float32))
+        self.warmup_seconds = time.perf_counter() - start_time
+
+    # LowLatencyPredictor of this model, created on first use (TFLite and ONNX models are already called directly)
+    def low_latency(self, max_batch_size=1):
+        if self.backend != 'keras':
+            return self.model
+        if self.low_latency_predictor is None or self.low_latency_predictor.max_batch_size < max_batch_size:
+            from chip_predictor import LowLatencyPredictor
+            self.low_latency_predictor = LowLatencyPredictor(self.model, max_batch_size)
+        return self.low_latency_predictor
+
+    # Load time and memory figures of the model
+    def stats(self):
+        stats = {
+            'model_path': self.model_path,
+            'color_mode': self.color_mode,
+            'backend': self.backend,
+            'load_seconds': self.load_seconds,
+            'warmup_seconds': self.warmup_seconds,
+            'file_bytes': os.path.getsize(self.model_path),
+        }
+        if self.backend == 'keras':
+            stats['parameters'] = int(self.model.count_params())
+            stats['weight_bytes'] = int(sum(weights.nbytes for weights in self.model.get_weights()))
+        return stats
+
+# Loaded models by (absolute model path, colour mode), one lock so that two threads never load the same model twice
+models = {}
+models_lock = threading.Lock()
+load_counts = {}        # loads of every model key in this process, the generation of the next load
+
+def model_key(model_path, color_mode):
+    return os.path.normcase(os.path.abspath(model_path)), color_mode
+
+# The shared ChipModel of the colour mode (default paths) or of an explicit model/class indices path
+def get_model(color_mode='rgb', model_path=None, class_indices_path=None):
+    default_model_path, default_class_indices_path = MODEL_PATHS[color_mode]
+    model_path = model_path or default_model_path
+    key = model_key(model_path, color_mode)
+    with models_lock:
+        if key not in models:
+            generation = load_counts.get(key, 0)
+            models[key] = ChipModel(model_path, class_indices_path or default_class_indices_path, color_mode, generation)
+            load_counts[key] = generation + 1
+        return models[key]
+
+# Load the model and run one warmup prediction in a daemon thread, returns the thread (join() it to wait)
+def warmup_in_background(color_mode='rgb', model_path=None, class_indices_path=None):
+    def load_and_warmup():
+        try:
+            chip_model = get_model(color_mode, model_path, class_indices_path)
+            if chip_model.warmup_seconds is None:
+                chip_model.warmup()
+        except Exception as error:      # the caller gets the same error from get_model on first use
+            print(f"Warning: warmup of the {color_mode} model failed: {error}")
+
+    thread = threading.Thread(target=load_and_warmup, name=f"warmup-{color_mode}", daemon=True)
+    thread.start()
+    return thread
+
+# Forget a loaded model (all of them when model_path is None), the next get_model loads it again
+def unload_model(color_mode=None, model_path=None):
+    with models_lock:
+        for key in list(models):
+            if (color_mode is None or key[1] == color_mode) and \
+                    (model_path is None or key[0] == model_key(model_path, key[1])[0]):
+                del models[key]
+
+# Load the model again (e.g. after a new training), the new load has another generation and so another identity:
+# the caches keyed by the old model identity are invalidated
+def reload_model(color_mode='rgb', model_path=None, class_indices_path=None):
+    unload_model(color_mode, model_path or MODEL_PATHS[color_mode][0])
+    return get_model(color_mode, model_path, class_indices_path)
+
+# Load time and memory figures of every loaded model, and the peak RSS of the process
+def registry_stats():
+    with models_lock:
+        stats = {'models': [chip_model.stats() for chip_model in models.values()]}
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats['max_rss_bytes'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+    return stats
@@ -0,0 +1,214 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import time
+import argparse
+import contextlib
+import traceback
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from frame_cache import Frame
+from get_barcode_n_image_rotated import load_image, get_barcode
+from get_tray_reduced_process import get_tray
+from warp_perspective_for_cropped_img import warp_polygon_to_rectangle
+from stage_profiler import StageRecorder
+from debug_sink import set_debug_mode, set_debug_context
+from station_profile import set_profile
+from image_cache import open_cache
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# Expand directories and glob patterns into a sorted list of image files
+def collect_images(inputs):
+    image_paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            names = sorted(os.listdir(item))
+            image_paths.extend(os.path.join(item, name) for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif os.path.isfile(item):
+            image_paths.append(item)
+        else:
+            matches = sorted(glob.glob(item, recursive=True))
+            image_paths.extend(path for path in matches if path.lower().endswith(IMAGE_EXTENSIONS))
+    return image_paths
+
+# Convert an OpenCV polygon (N, 1, 2) into a JSON friendly list of [x, y]
+def polygon_to_list(polygon):
+    return polygon.reshape(-1, 2).tolist()
+
+# Name of the crops of an image: its file name plus a short hash of its full path, so that images with the same name
+# in different folders (e.g. day1/tray (1).jpg and day2/tray (1).jpg) do not overwrite each other's crops
+def crop_stem(image_path):
+    path_hash = hashlib.sha1(os.path.normcase(os.path.abspath(image_path)).encode('utf-8')).hexdigest()[:8]
+    return f"{Path(image_path).stem}_{path_hash}"
+
+# Run barcode -> warp -> tray -> warp on one image and return a JSON friendly result, never raises
+def process_image(image_path, settings):
+    result = {'image': image_path, 'status': 'ok', 'barcode_polygon': None, 'tray_polygons': [],
+              'barcode_crop': None, 'tray_crops': [], 'timings': {}, 'error': None}
+    stem = crop_stem(image_path)
+    crops_dir = settings['crops_dir']
+    # One recorder per image, the main process merges the records of every worker
+    recorder = StageRecorder(track_memory=settings['track_memory'], profile_slowest=1 if settings['profile'] else 0)
+
+    try:
+        # The pipeline prints progress for every fallback, keep the worker output quiet unless asked
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if settings['verbose'] else devnull), \
+                recorder.profile_image(image_path):
+            set_debug_context(image_path)
+            # Step 1: Load input image
+            with recorder.stage('load'):
+                if settings['image_cache']:
+                    # Zero-copy view of the pre-decoded image, the pipeline never writes into its input
+                    input_image = open_cache(settings['image_cache']).load_image(image_path, settings['width'], settings['height'])
+                else:
+                    input_image = load_image(image_path, settings['width'], settings['height'])
+            if input_image is None:
+                result['status'] = 'load_failed'
+                return result
+            frame = Frame(input_image)
+
+            # Step 2: Detect barcode and rotate the frame
+            with recorder.stage('barcode'):
+                rotated_image, barcode_polygon, _ = get_barcode(
+                    frame, min_area=settings['barcode_min_area'], max_area=settings['barcode_max_area'], crop=False)
+            if barcode_polygon is None:
+                result['status'] = 'no_barcode'
+                return result
+            result['barcode_polygon'] = polygon_to_list(barcode_polygon)
+
+            with recorder.stage('barcode_warp'):
+                warped_barcode = warp_polygon_to_rectangle(rotated_image, barcode_polygon)
+                if crops_dir:
+                    result['barcode_crop'] = os.path.join(crops_dir, f"{stem}_barcode.png")
+                    cv2.imwrite(result['barcode_crop'], warped_barcode)
+
+            # Step 3: Detect tray on the rotated frame (one process per core already, so no extra threads)
+            with recorder.stage('tray'):
+                tray_image, tray_polygons = get_tray(frame, min_area=settings['tray_min_area'],
+                                                     epsilon_factor=settings['epsilon_factor'], max_workers=1)
+            if not tray_polygons:
+                result['status'] = 'no_tray'
+                return result
+            result['tray_polygons'] = [polygon_to_list(polygon) for polygon in tray_polygons]
+
+            # Step 4: Warp every detected tray
+            with recorder.stage('tray_warp'):
+                for index, tray_polygon in enumerate(tray_polygons):
+                    warped_tray = warp_polygon_to_rectangle(rotated_image, tray_polygon)
+                    if crops_dir:
+                        crop_path = os.path.join(crops_dir, f"{stem}_tray{index}.png")
+                        cv2.imwrite(crop_path, warped_tray)
+                        result['tray_crops'].append(crop_path)
+    except Exception as error:
+        result['status'] = 'error'
+        result['error'] = f"{type(error).__name__}: {error}"
+        result['traceback'] = traceback.format_exc()
+    finally:
+        result['timings'] = recorder.stage_times(image_path)
+        # Not written to the JSON Lines file, collected by run_batch
+        result['stage_records'] = recorder.records
+        result['profile'] = None
+        if recorder.slowest_profiles:
+            seconds, _, _, stats = recorder.slowest_profiles[0]
+            result['profile'] = (seconds, stats)
+
+    return result
+
+# Every worker process runs one image at a time, so OpenCV should not start its own threads
+# Debug images are never shown in the workers: either off or written to disk in the background
+# (with --debug-dir the HSV range threads of the workers save theirs too)
+# The station profile is loaded once per worker, not once per image
+def init_worker(debug_mode='off', debug_dir=None, station_profile=None):
+    cv2.setNumThreads(1)
+    set_debug_mode(debug_mode, debug_dir, worker_mode='disk' if debug_mode == 'disk' else 'off')
+    if station_profile:
+        set_profile(station_profile)
+
+def run_batch(image_paths, output_path, settings, workers=None, recorder=None):
+    workers = workers or os.cpu_count() or 1
+    recorder = recorder or StageRecorder()
+    counts = {}
+    start_time = time.time()
+    with open(output_path, 'w', encoding='utf-8') as output_file, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(settings['debug_mode'], settings['debug_dir'],
+                                          settings['station_profile'])) as executor:
+        # map keeps the input order and hands the results back as soon as they are ready
+        results = executor.map(process_image, image_paths, [settings] * len(image_paths), chunksize=1)
+        for result in results:
+            recorder.merge(result.pop('stage_records'))
+            profile = result.pop('profile')
+            if profile is not None:
+                recorder.add_profile(result['image'], profile[0], profile[1])
+            output_file.write(json.dumps(result) + '\n')
+            output_file.flush()
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            if result['status'] != 'ok':
+                print(f"{result['image']}: {result['status']}" + (f" ({result['error']})" if result['error'] else ''))
+    elapsed = time.time() - start_time
+    print(f"Processed {len(image_paths)} images with {workers} workers in {elapsed:.2f} seconds: {counts}")
+    recorder.print_summary()
+    return counts
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless barcode -> warp -> tray -> warp processing of many tray images.")
+    parser.add_argument('inputs', nargs='+', help="Image files, directories or glob patterns (quote the pattern)")
+    parser.add_argument('-o', '--output', default='tray_results.jsonl', help="JSON Lines file with one result per image")
+    parser.add_argument('--crops-dir', default=None, help="Directory for the warped barcode and tray crops (not written if omitted)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Number of worker processes (default: number of cores)")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--barcode-min-area', type=float, default=5000)
+    parser.add_argument('--barcode-max-area', type=float, default=100000)
+    parser.add_argument('--tray-min-area', type=float, default=50000)
+    parser.add_argument('--epsilon-factor', type=float, default=0.02)
+    parser.add_argument('--stats-json', default=None, help="Write the per-stage percentiles (and every record) to this JSON file")
+    parser.add_argument('--stats-csv', default=None, help="Write the per-stage percentiles to this CSV file")
+    parser.add_argument('--track-memory', action='store_true', help="Record the peak allocation of every stage (slower)")
+    parser.add_argument('--profile-slowest', type=int, default=0, help="cProfile every image and keep the N slowest profiles")
+    parser.add_argument('--profile-dir', default='profiles', help="Directory for the .prof files of --profile-slowest")
+    parser.add_argument('--station-profile', default=os.environ.get('DETECTION_PROFILE'),
+                        help="Station profile written by calibrate_station.py (name or .json path, default: $DETECTION_PROFILE)")
+    parser.add_argument('--image-cache', default=None, help="Pre-decoded image cache built by image_cache.py")
+    parser.add_argument('--debug-dir', default=None, help="Write the intermediate debug images of every image to this directory")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Show the pipeline prints of every image")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    image_paths = collect_images(args.inputs)
+    if not image_paths:
+        print("No images found.")
+        return 1
+    if args.crops_dir:
+        os.makedirs(args.crops_dir, exist_ok=True)
+
+    settings = {
+        'width': args.width, 'height': args.height,
+        'barcode_min_area': args.barcode_min_area, 'barcode_max_area': args.barcode_max_area,
+        'tray_min_area': args.tray_min_area, 'epsilon_factor': args.epsilon_factor,
+        'crops_dir': args.crops_dir, 'verbose': args.verbose,
+        'track_memory': args.track_memory, 'profile': args.profile_slowest > 0,
+        'debug_mode': 'disk' if args.debug_dir else 'off', 'debug_dir': args.debug_dir,
+        'station_profile': args.station_profile, 'image_cache': args.image_cache,
+    }
+    recorder = StageRecorder(profile_slowest=args.profile_slowest)
+    run_batch(image_paths, args.output, settings, args.workers, recorder)
+
+    if args.stats_json:
+        recorder.export_json(args.stats_json)
+    if args.stats_csv:
+        recorder.export_csv(args.stats_csv)
+    if args.profile_slowest > 0:
+        for path in recorder.dump_profiles(args.profile_dir):
+            print(f"Saved profile: {path}")
+    return 0
+
+# Example: python batch_process.py "../dataset/archive/*.jpg" -o results.jsonl --crops-dir crops
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+
+import cv2
+from frame_cache import Frame
+from stage_profiler import StageRecorder
+from batch_process import collect_images
+from get_barcode_n_image_rotated import load_image, get_barcode
+from get_tray_reduced_process import get_tray
+from get_substrate_from_tray import processing_for_substrates
+from warp_perspective_for_cropped_img import warp_polygon_to_rectangle
+from debug_sink import set_debug_mode
+from station_profile import set_profile
+from image_cache import open_cache
+
+try:
+    import resource     # Not available on Windows, the peak RSS is then not reported
+except ImportError:
+    resource = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATASET = os.path.join(SCRIPT_DIR, '..', 'labelImg_xml_and_crop', 'Trays_and_annotate_all')
+DEFAULT_BASELINE = os.path.join(SCRIPT_DIR, 'benchmark_baseline.json')
+
+# Stages and rates compared against the baseline
+LATENCY_KEYS = ('wall_p50', 'wall_p95')
+SUCCESS_RATES = ('barcode_found', 'tray_found', 'six_substrates')
+FALLBACK_RATES = ('barcode_rotated', 'tray_fallback', 'substrate_fallback')
+
+# Run every stage on one image, the outcome of each stage is counted in counters
+def benchmark_image(image_path, recorder, settings, counters):
+    with recorder.profile_image(image_path):
+        with recorder.stage('load'):
+            if settings['image_cache']:
+                input_image = open_cache(settings['image_cache']).load_image(image_path, settings['width'], settings['height'])
+            else:
+                input_image = load_image(image_path, settings['width'], settings['height'], settings['reduced_decode'])
+        if input_image is None:
+            counters['load_failed'] += 1
+            return
+        frame = Frame(input_image)
+
+        stats = {}
+        with recorder.stage('barcode'):
+            rotated_image, barcode_polygon, _ = get_barcode(frame, 5000, 100000, crop=False, stats=stats)
+        if barcode_polygon is None:
+            return
+        counters['barcode_found'] += 1
+        counters['barcode_rotated'] += 1 if stats['quarter_turns'] else 0
+
+        with recorder.stage('tray'):
+            _, tray_polygons = get_tray(frame, 50000, max_workers=settings['max_workers'], stats=stats)
+        counters['tray_attempts'] += 1
+        counters['tray_fallback'] += 1 if stats['tray_hsv_range'] != 0 else 0
+        if not tray_polygons:
+            return
+        counters['tray_found'] += 1
+
+        with recorder.stage('warp'):
+            warped_tray = warp_polygon_to_rectangle(rotated_image, tray_polygons[0])
+
+        with recorder.stage('substrate'):
+            processing_for_substrates(warped_tray, settings['substrate_min_size'], settings['substrate_min_size'],
+                                      max_workers=settings['max_workers'], display=False, stats=stats)
+        counters['substrate_attempts'] += 1
+        counters['substrate_fallback'] += 1 if stats['substrate_hsv_range'] != 0 else 0
+        counters['six_substrates'] += 1 if stats['substrate_count'] == 6 else 0
+
+# Run the pipeline over the images (repeat times) and build the report
+def run_benchmark(image_paths, settings, repeat=1, track_memory=False, profile_slowest=0):
+    recorder = StageRecorder(track_memory=track_memory, profile_slowest=profile_slowest)
+    counters = dict.fromkeys(['load_failed', 'barcode_found', 'barcode_rotated', 'tray_attempts', 'tray_found',
+                              'tray_fallback', 'substrate_attempts', 'substrate_fallback', 'six_substrates'], 0)
+    start_time = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if settings['verbose'] else devnull):
+        for _ in range(repeat):
+            for image_path in image_paths:
+                benchmark_image(image_path, recorder, settings, counters)
+    total_seconds = time.perf_counter() - start_time
+    runs = len(image_paths) * repeat
+
+    # Success rates are over every image, fallback rates over the images that reached the stage
+    rates = {
+        'barcode_found': counters['barcode_found'] / max(runs, 1),
+        'tray_found': counters['tray_found'] / max(runs, 1),
+        'six_substrates': counters['six_substrates'] / max(runs, 1),
+        'barcode_rotated': counters['barcode_rotated'] / max(counters['barcode_found'], 1),
+        'tray_fallback': counters['tray_fallback'] / max(counters['tray_attempts'], 1),
+        'substrate_fallback': counters['substrate_fallback'] / max(counters['substrate_attempts'], 1),
+    }
+    memory = {}
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory['max_rss_bytes'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    # The report keeps its own copy of the settings, without 'verbose' (only the output, not the results, depends on it)
+    report_settings = dict(settings)
+    report_settings.pop('verbose', None)
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': {'python': platform.python_version(), 'opencv': cv2.__version__,
+                        'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'settings': report_settings,
+        'images': len(image_paths),
+        'repeat': repeat,
+        'total_seconds': total_seconds,
+        'images_per_second': runs / total_seconds if total_seconds > 0 else 0.0,
+        'counters': counters,
+        'rates': rates,
+        'stages': recorder.summary(),
+        'memory': memory,
+    }
+    return report, recorder
+
+# Return a list of human readable regressions of report against baseline
+def compare_with_baseline(report, baseline, latency_tolerance=0.2, rate_tolerance=0.02):
+    regressions = []
+    for stage, stage_summary in report['stages'].items():
+        baseline_stage = baseline.get('stages', {}).get(stage)
+        if not baseline_stage:
+            continue
+        for key in LATENCY_KEYS:
+            old, new = baseline_stage[key], stage_summary[key]
+            if old > 0 and new > old * (1 + latency_tolerance):
+                regressions.append(f"{stage} {key}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms (+{(new / old - 1) * 100:.0f}%)")
+    for key in SUCCESS_RATES:
+        old, new = baseline['rates'].get(key), report['rates'][key]
+        if old is not None and new < old - rate_tolerance:
+            regressions.append(f"{key} rate: {old:.1%} -> {new:.1%}")
+    for key in FALLBACK_RATES:
+        old, new = baseline['rates'].get(key), report['rates'][key]
+        if old is not None and new > old + rate_tolerance:
+            regressions.append(f"{key} rate: {old:.1%} -> {new:.1%}")
+    if baseline.get('settings') != report['settings']:
+        print("Warning: the baseline was recorded with different settings.")
+    return regressions
+
+def print_report(report):
+    print(f"{report['images']} images x {report['repeat']}: {report['total_seconds']:.2f} s, "
+          f"{report['images_per_second']:.2f} images/s")
+    for stage, stage_summary in report['stages'].items():
+        line = (f"{stage:>10}: n={stage_summary['count']:<5} p50={stage_summary['wall_p50'] * 1000:8.1f} ms"
+                f"  p95={stage_summary['wall_p95'] * 1000:8.1f} ms")
+        if 'peak_bytes_max' in stage_summary:
+            line += f"  peak={stage_summary['peak_bytes_max'] / 1e6:6.1f} MB"
+        print(line)
+    for key, value in report['rates'].items():
+        print(f"{key:>20}: {value:.1%}")
+    if 'max_rss_bytes' in report['memory']:
+        print(f"{'max RSS':>20}: {report['memory']['max_rss_bytes'] / 1e6:.1f} MB")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark barcode, tray, warp and substrate detection over the annotated tray images.")
+    parser.add_argument('--dataset', nargs='+', default=[DEFAULT_DATASET], help="Image files, directories or glob patterns")
+    parser.add_argument('--repeat', type=int, default=1, help="Run the dataset this many times")
+    parser.add_argument('--output', default=None, help="Write the full report to this JSON file")
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, default=None,
+                        help="Store the report as the baseline (default: benchmark_baseline.json next to this script)")
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, default=None,
+                        help="Compare with a stored baseline and exit with 1 if something regressed")
+    parser.add_argument('--latency-tolerance', type=float, default=0.2, help="Allowed relative p50/p95 increase (0.2 = 20%%)")
+    parser.add_argument('--rate-tolerance', type=float, default=0.02, help="Allowed absolute change of the success/fallback rates")
+    parser.add_argument('--max-workers', type=int, default=None, help="Threads for the HSV ranges (1 = sequential cascade)")
+    parser.add_argument('--substrate-min-size', type=int, default=50, help="Minimum substrate width/height on the warped tray")
+    parser.add_argument('--station-profile', default=os.environ.get('DETECTION_PROFILE'),
+                        help="Station profile written by calibrate_station.py (name or .json path, default: $DETECTION_PROFILE)")
+    parser.add_argument('--image-cache', default=None, help="Pre-decoded image cache built by image_cache.py (load stage from the cache)")
+    parser.add_argument('--reduced-decode', action='store_true',
+                        help="Decode large JPEGs at reduced resolution (compare the rates with a run without it)")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--track-memory', action='store_true', help="Record the tracemalloc peak of every stage (slower)")
+    parser.add_argument('--profile-slowest', type=int, default=0, help="Keep cProfile output of the N slowest images")
+    parser.add_argument('--profile-dir', default='profiles')
+    parser.add_argument('-v', '--verbose', action='store_true', help="Show the pipeline prints")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Measure the pipeline as it runs on the line, without any debug image
+    set_debug_mode('off')
+    profile = set_profile(args.station_profile)
+    image_paths = collect_images(args.dataset)
+    if not image_paths:
+        print("No images found.")
+        return 1
+
+    settings = {'width': args.width, 'height': args.height, 'max_workers': args.max_workers,
+                'substrate_min_size': args.substrate_min_size, 'verbose': args.verbose,
+                'station_profile': profile['name'], 'image_cache': args.image_cache,
+                'reduced_decode': args.reduced_decode}
+    report, recorder = run_benchmark(image_paths, settings, args.repeat, args.track_memory, args.profile_slowest)
+    print_report(report)
+
+    if args.profile_slowest > 0:
+        for path in recorder.dump_profiles(args.profile_dir):
+            print(f"Saved profile: {path}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.latency_tolerance, args.rate_tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regression against the baseline.")
+    return 0
+
+# Example: python benchmark_pipeline.py --save-baseline, then after a threshold change: python benchmark_pipeline.py --compare
+if __name__ == "__main__":
+    sys.exit(main())
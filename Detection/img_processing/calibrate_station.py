@@ -0,0 +1,305 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import contextlib
+
+from frame_cache import Frame
+from batch_process import collect_images
+from hsv_fallback import build_range_bits, range_mask, get_executor
+from debug_sink import set_debug_mode
+from station_profile import save_profile, stage_settings
+from get_barcode_n_image_rotated import load_image, get_barcode, find_barcode_polygon, BARCODE_SETTINGS
+from get_tray_reduced_process import get_tray, find_polygons, TRAY_SETTINGS
+from get_substrate_from_tray import find_bounding_boxes, SUBSTRATE_SETTINGS
+from warp_perspective_for_cropped_img import warp_polygon_to_rectangle
+
+# Calibrate the detectors of one station from sample images and save the result as a named profile
+#   python calibrate_station.py line2 "../dataset/line2/*.jpg"
+#   DETECTION_PROFILE=line2 python batch_process.py ...
+# There is no ground truth, so every candidate is scored with the acceptance rule of its stage:
+#   barcode   -> a 4-sided polygon is found
+#   tray      -> at least one tray polygon is found, exactly one is preferred
+#   substrate -> exactly 6 substrates on the warped tray
+# The best candidate becomes the first HSV range, the next ranges are picked greedily among the images it misses,
+# so the runtime fallbacks are only used for the images that really need them
+
+# Candidate grids, the defaults of the detectors are always tried first and win the ties
+BARCODE_BLURS = [(3, 3), (3, 1), (3, 2), (5, 1), (5, 2), (5, 3)]
+BARCODE_CANNY = [(0.7, 1.3), (0.5, 1.5), (0.66, 1.33), (0.8, 1.2)]
+TRAY_BLUR_SIGMAS = [1, 2, 3]
+TRAY_SATURATION_MAX = [20, 40, 60, 80]
+TRAY_VALUE_MIN = [40, 60, 80]
+TRAY_VALUE_MAX = [140, 160, 180, 200, 220]
+SUBSTRATE_BLUR_KSIZES = [5, 3, 7]
+SUBSTRATE_HUE_MIN = [5, 10, 15, 20]
+SUBSTRATE_HUE_MAX = [85, 95]
+SUBSTRATE_SATURATION_MIN = [30, 50, 70]
+SUBSTRATE_VALUE_MIN = [30, 50, 70]
+MAX_RANGES = 3      # first range + fallbacks kept in the profile
+
+# Candidate ranges with the default ranges first, duplicates removed
+def candidate_ranges(default_ranges, generated_ranges):
+    candidates = []
+    for lower, upper in list(default_ranges) + list(generated_ranges):
+        hsv_range = (tuple(int(v) for v in lower), tuple(int(v) for v in upper))
+        if hsv_range not in candidates:
+            candidates.append(hsv_range)
+    return candidates
+
+def tray_candidate_ranges():
+    generated = [((0, 0, v_min), (180, s_max, v_max))
+                 for s_max, v_min, v_max in itertools.product(TRAY_SATURATION_MAX, TRAY_VALUE_MIN, TRAY_VALUE_MAX)]
+    return candidate_ranges(TRAY_SETTINGS['hsv_ranges'], generated)
+
+def substrate_candidate_ranges():
+    generated = [((h_min, s_min, v_min), (h_max, 255, 255))
+                 for h_min, h_max, s_min, v_min in itertools.product(SUBSTRATE_HUE_MIN, SUBSTRATE_HUE_MAX,
+                                                                     SUBSTRATE_SATURATION_MIN, SUBSTRATE_VALUE_MIN)]
+    return candidate_ranges(SUBSTRATE_SETTINGS['hsv_ranges'], generated)
+
+# evaluate(mask) for every range, the masks are built 8 ranges at a time from one HSV image
+def evaluate_ranges(hsv_image, hsv_ranges, evaluate):
+    results = []
+    for start in range(0, len(hsv_ranges), 8):
+        chunk = hsv_ranges[start:start + 8]
+        range_bits = build_range_bits(hsv_image, chunk)
+        results.extend(evaluate(range_mask(range_bits, index)) for index in range(len(chunk)))
+    return results
+
+# scores[image][candidate] is a tuple, higher is better and score[0] > 0 means the candidate succeeded on the image
+# The first candidate maximises the summed score, every next one the number of images nobody succeeded on yet
+def choose_ranges(scores, max_ranges=MAX_RANGES):
+    candidate_count = len(scores[0]) if scores else 0
+    totals = [tuple(map(sum, zip(*(image_scores[c] for image_scores in scores)))) for c in range(candidate_count)]
+    chosen = [max(range(candidate_count), key=lambda c: totals[c])] if candidate_count else []
+    covered = {i for i, image_scores in enumerate(scores) if chosen and image_scores[chosen[0]][0] > 0}
+    while len(chosen) < max_ranges:
+        gains = [sum(1 for i, image_scores in enumerate(scores) if i not in covered and image_scores[c][0] > 0)
+                 for c in range(candidate_count)]
+        best = max(range(candidate_count), key=lambda c: gains[c], default=None)
+        if best is None or gains[best] == 0:
+            break
+        chosen.append(best)
+        covered |= {i for i, image_scores in enumerate(scores) if image_scores[best][0] > 0}
+    return chosen, covered
+
+def success_rate(scores, candidate, image_count):
+    return sum(1 for image_scores in scores if image_scores[candidate][0] > 0) / max(image_count, 1)
+
+# Every n-th sample image is held out: it is not used to choose the settings, only to report the rates
+# (holdout_fraction=0 reports the rates on the images the settings were chosen on)
+def holdout_flags(image_count, holdout_fraction):
+    if holdout_fraction <= 0 or image_count < 2:
+        return [False] * image_count
+    step = max(2, round(1 / holdout_fraction))
+    return [index % step == step - 1 for index in range(image_count)]
+
+# (fit scores, held-out scores) of the images that reached the stage (None = the image did not reach it)
+# Without any held-out image the rates are reported on the fit images
+def split_scores(scores, holdout):
+    fit = [image_scores for image_scores, held in zip(scores, holdout) if image_scores is not None and not held]
+    held_out = [image_scores for image_scores, held in zip(scores, holdout) if image_scores is not None and held]
+    return fit, held_out or fit
+
+# Load every sample image in the worker threads and keep only score(image), so a single image per thread is in memory
+# (score returns None when the image does not reach the stage, as does an image that cannot be loaded)
+def score_images(image_paths, settings, score):
+    def load_and_score(image_path):
+        image = load_image(image_path, settings['width'], settings['height'])
+        return None if image is None else score(image)
+    return list(get_executor().map(load_and_score, image_paths))
+
+# Rates of the chosen ranges on the held-out images: first attempt with the first range and with its fallbacks
+def held_out_rates(scores, chosen):
+    covered = sum(1 for image_scores in scores if any(image_scores[c][0] > 0 for c in chosen))
+    return {'calibrated': success_rate(scores, chosen[0], len(scores)) if chosen else 0.0,
+            'with_fallbacks': covered / max(len(scores), 1)}
+
+# Pick the setting (blur) and the HSV ranges of a stage from the scores of every setting on the fit images, the first
+# setting wins the ties. scores_by_setting: {setting: [per image candidate scores or None]}
+# Returns (setting, chosen candidate indices, held-out rates)
+def choose_setting_and_ranges(scores_by_setting, holdout, default_setting):
+    best = None
+    for setting, scores in scores_by_setting.items():
+        fit, held_out = split_scores(scores, holdout)
+        chosen, covered = choose_ranges(fit)
+        rank = (success_rate(fit, chosen[0], len(fit)) if chosen else 0.0, len(covered))
+        if best is None or rank > best[0]:
+            best = (rank, setting, chosen, held_out)
+    _, setting, chosen, held_out = best
+    _, default_held_out = split_scores(scores_by_setting[default_setting], holdout)
+    rates = dict(default=success_rate(default_held_out, 0, len(default_held_out)), **held_out_rates(held_out, chosen))
+    return setting, chosen, rates
+
+# Barcode: pick the blur and Canny factors that find a 4-sided polygon on the most images
+def calibrate_barcode(image_paths, holdout, settings):
+    candidates = [{'blur_ksize': k, 'blur_sigma': s, 'canny_lower': lower, 'canny_upper': upper}
+                  for (k, s), (lower, upper) in itertools.product(BARCODE_BLURS, BARCODE_CANNY)]
+    def score(image):
+        frame = Frame(image)
+        polygons = [find_barcode_polygon(frame, settings['barcode_min_area'], settings['barcode_max_area'],
+                                         profile={'barcode': candidate}) for candidate in candidates]
+        return [(1 if polygon is not None and len(polygon) == 4 else 0,) for polygon in polygons]
+    scores = score_images(image_paths, settings, score)
+    fit, held_out = split_scores(scores, holdout)
+    best = max(range(len(candidates)), key=lambda c: sum(image_scores[c][0] for image_scores in fit))
+    rates = {'default': success_rate(held_out, 0, len(held_out)), 'calibrated': success_rate(held_out, best, len(held_out))}
+    return candidates[best], rates, sum(1 for image_scores in scores if image_scores is not None)
+
+# Frame of the image rotated with the barcode settings of the profile, like at runtime (None if no barcode is found)
+def rotated_frame(image, settings, profile):
+    frame = Frame(image)
+    _, barcode_polygon, _ = get_barcode(frame, settings['barcode_min_area'], settings['barcode_max_area'],
+                                        crop=False, profile=profile)
+    return frame if barcode_polygon is not None else None
+
+# Tray: pick the blur sigma and the HSV ranges, on the frames rotated by the calibrated barcode stage
+def calibrate_tray(image_paths, holdout, settings, profile):
+    hsv_ranges = tray_candidate_ranges()
+    def score(image):
+        frame = rotated_frame(image, settings, profile)
+        if frame is None:
+            return None
+        image_scores = {}
+        for blur_sigma in TRAY_BLUR_SIGMAS:
+            hsv_image = frame.blurred_brightened_hsv((0, 0), blur_sigma, value=TRAY_SETTINGS['brightness'])
+            results = evaluate_ranges(hsv_image, hsv_ranges,
+                                      lambda mask: find_polygons(None, mask, settings['tray_min_area'], settings['epsilon_factor']))
+            image_scores[blur_sigma] = [(1 if polygons else 0, 1 if len(polygons) == 1 else 0) for polygons in results]
+        return image_scores
+    scores = score_images(image_paths, settings, score)
+    scores_by_sigma = {blur_sigma: [None if image_scores is None else image_scores[blur_sigma] for image_scores in scores]
+                       for blur_sigma in TRAY_BLUR_SIGMAS}
+    blur_sigma, chosen, rates = choose_setting_and_ranges(scores_by_sigma, holdout, TRAY_SETTINGS['blur_sigma'])
+    tray_settings = {'blur_sigma': blur_sigma, 'hsv_ranges': [hsv_ranges[c] for c in chosen] or TRAY_SETTINGS['hsv_ranges']}
+    return tray_settings, rates, sum(1 for image_scores in scores if image_scores is not None)
+
+# Substrate: pick the blur kernel and the HSV ranges on the trays warped with the calibrated barcode and tray stages
+def calibrate_substrate(image_paths, holdout, settings, profile):
+    hsv_ranges = substrate_candidate_ranges()
+    min_size = settings['substrate_min_size']
+    def score(image):
+        frame = rotated_frame(image, settings, profile)
+        if frame is None:
+            return None
+        _, tray_polygons = get_tray(frame, settings['tray_min_area'], settings['epsilon_factor'], max_workers=1, profile=profile)
+        if not tray_polygons:
+            return None
+        tray = Frame(warp_polygon_to_rectangle(frame.image, tray_polygons[0]))
+        image_scores = {}
+        for blur_ksize in SUBSTRATE_BLUR_KSIZES:
+            hsv_image = tray.blurred_brightened_hsv((blur_ksize, blur_ksize), 0, value=SUBSTRATE_SETTINGS['brightness'])
+            results = evaluate_ranges(hsv_image, hsv_ranges, lambda mask: find_bounding_boxes(
+                None, mask, min_size, min_size, dilate_iterations=SUBSTRATE_SETTINGS['dilate_iterations']))
+            # Exactly 6 is a success, otherwise closer to 6 is better
+            image_scores[blur_ksize] = [(1 if len(boxes) == 6 else 0, -abs(len(boxes) - 6)) for boxes in results]
+        return image_scores
+    scores = score_images(image_paths, settings, score)
+    trays_found = sum(1 for image_scores in scores if image_scores is not None)
+    if not trays_found:
+        return None, None, 0
+    scores_by_ksize = {blur_ksize: [None if image_scores is None else image_scores[blur_ksize] for image_scores in scores]
+                       for blur_ksize in SUBSTRATE_BLUR_KSIZES}
+    blur_ksize, chosen, rates = choose_setting_and_ranges(scores_by_ksize, holdout, SUBSTRATE_SETTINGS['blur_ksize'])
+    substrate_settings = {'blur_ksize': blur_ksize,
+                          'hsv_ranges': [hsv_ranges[c] for c in chosen] or SUBSTRATE_SETTINGS['hsv_ranges']}
+    return substrate_settings, rates, trays_found
+
+# Run the three calibrations in pipeline order and return the profile (only the values that differ from the defaults)
+# The images are read again for every stage instead of being kept in memory, the stages only keep per-image scores
+# The settings are chosen on the images that are not held out (see holdout_flags), the rates are those of the held-out ones
+def calibrate(name, image_paths, settings, holdout_fraction=0.25):
+    holdout = holdout_flags(len(image_paths), holdout_fraction)
+    profile = {'name': name}
+    rates = {}
+
+    profile['barcode'], rates['barcode'], images = calibrate_barcode(image_paths, holdout, settings)
+    if not images:
+        raise ValueError("None of the sample images could be loaded.")
+
+    # The tray is searched on the frame rotated with the calibrated barcode settings, like at runtime
+    tray_settings, tray_rates, barcode_found = calibrate_tray(image_paths, holdout, settings, profile)
+    if not barcode_found:
+        raise ValueError("No barcode found on the sample images, the tray and substrates cannot be calibrated.")
+    profile['tray'], rates['tray'] = tray_settings, tray_rates
+
+    substrate_settings, substrate_rates, trays_found = calibrate_substrate(image_paths, holdout, settings, profile)
+    if trays_found:
+        profile['substrate'], rates['substrate'] = substrate_settings, substrate_rates
+    else:
+        print("No tray found on the sample images, the substrate stage keeps its defaults.")
+
+    # Keep only what differs from the detector defaults so later default changes still apply
+    for stage, defaults in (('barcode', BARCODE_SETTINGS), ('tray', TRAY_SETTINGS), ('substrate', SUBSTRATE_SETTINGS)):
+        if stage not in profile:
+            continue
+        overrides = {}
+        for key, value in profile[stage].items():
+            default = defaults[key]
+            if key == 'hsv_ranges':
+                value = [[list(lower), list(upper)] for lower, upper in value]
+                default = [[list(lower), list(upper)] for lower, upper in default]
+            if value != default:
+                overrides[key] = value
+        profile[stage] = overrides
+        stage_settings(stage, defaults, profile)    # validate the keys
+
+    profile['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    profile['calibration'] = {'images': images, 'held_out_images': sum(holdout), 'barcode_found': barcode_found,
+                              'trays_found': trays_found, 'settings': settings, 'first_attempt_rates': rates}
+    return profile
+
+def print_rates(rates):
+    for stage, stage_rates in rates.items():
+        line = f"{stage:>10}: first attempt {stage_rates['default']:.1%} -> {stage_rates['calibrated']:.1%}"
+        if 'with_fallbacks' in stage_rates:
+            line += f", with fallbacks {stage_rates['with_fallbacks']:.1%}"
+        print(line)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Learn the HSV ranges and blur/Canny parameters of a station and save them as a profile.")
+    parser.add_argument('name', help="Profile name (saved to station_profiles/<name>.json) or path of a .json file")
+    parser.add_argument('inputs', nargs='+', help="Sample images of the station: files, directories or glob patterns")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--barcode-min-area', type=float, default=5000)
+    parser.add_argument('--barcode-max-area', type=float, default=100000)
+    parser.add_argument('--tray-min-area', type=float, default=50000)
+    parser.add_argument('--epsilon-factor', type=float, default=0.02)
+    parser.add_argument('--substrate-min-size', type=int, default=50, help="Minimum substrate width/height on the warped tray")
+    parser.add_argument('--holdout', type=float, default=0.25,
+                        help="Share of the sample images held out to report the rates (0 = report on the fit images)")
+    parser.add_argument('--dry-run', action='store_true', help="Print the result without saving the profile")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    set_debug_mode('off')
+    image_paths = collect_images(args.inputs)
+    if not image_paths:
+        print("No images found.")
+        return 1
+
+    settings = {'width': args.width, 'height': args.height,
+                'barcode_min_area': args.barcode_min_area, 'barcode_max_area': args.barcode_max_area,
+                'tray_min_area': args.tray_min_area, 'epsilon_factor': args.epsilon_factor,
+                'substrate_min_size': args.substrate_min_size}
+    start_time = time.time()
+    # The detectors print every fallback, the calibration runs them thousands of times
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        profile = calibrate(args.name, image_paths, settings, args.holdout)
+    held_out_images = profile['calibration']['held_out_images']
+    print(f"Calibrated on {len(image_paths)} images in {time.time() - start_time:.1f} seconds, rates on "
+          + (f"the {held_out_images} held-out images:" if held_out_images else "the calibration images:"))
+    print_rates(profile['calibration']['first_attempt_rates'])
+    for stage in ('barcode', 'tray', 'substrate'):
+        print(f"{stage:>10}: {profile.get(stage) or 'defaults'}")
+    if not args.dry_run:
+        print(f"Profile saved to {save_profile(profile, args.name)}")
+    return 0
+
+# Example: python calibrate_station.py sony ../labelImg_xml_and_crop/Trays_and_annotate_all
+if __name__ == "__main__":
+    sys.exit(main())
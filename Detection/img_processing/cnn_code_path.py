@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Makes the chip CNN modules of CNN_code (chip_predictor, ...) importable from the img_processing scripts,
+# import it before them:
+#   import cnn_code_path
+#   from chip_predictor import inverse_class_indices
+CNN_CODE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CNN_code'))
+if CNN_CODE_DIR not in sys.path:
+    sys.path.append(CNN_CODE_DIR)
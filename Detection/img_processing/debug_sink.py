@@ -0,0 +1,124 @@
+import os
+import re
+import queue
+import atexit
+import threading
+
+import cv2
+
+# One debug sink shared by every module, replacing the per-module display_image
+#   off         -> display_image returns immediately (use it on the line and in batch runs)
+#   disk        -> the image is copied and a background thread encodes it into debug_dir (DETECTION_DEBUG_DIR)
+#   interactive -> the old behaviour: resizable window, wait for a key
+# The mode comes from the DETECTION_DEBUG environment variable (default interactive) or set_debug_mode()
+# Worker threads (e.g. the HSV range pool) cannot open windows and run on the hot path, their images follow
+# worker_debug_mode instead: off (default) or disk, from DETECTION_DEBUG_WORKERS or set_debug_mode(worker_mode=...)
+DEBUG_MODES = ('off', 'disk', 'interactive')
+WORKER_DEBUG_MODES = ('off', 'disk')
+debug_mode = os.environ.get('DETECTION_DEBUG', 'interactive').lower()
+if debug_mode not in DEBUG_MODES:
+    debug_mode = 'interactive'
+worker_debug_mode = os.environ.get('DETECTION_DEBUG_WORKERS', 'off').lower()
+if worker_debug_mode not in WORKER_DEBUG_MODES:
+    worker_debug_mode = 'off'
+debug_dir = os.environ.get('DETECTION_DEBUG_DIR', 'debug_images')
+debug_context = ''      # prefix of the saved files, e.g. the name of the image being processed
+max_queued_images = 256
+
+writer_queue = None
+writer_thread = None
+writer_lock = threading.Lock()
+image_counter = 0
+dropped_images = 0
+
+def set_debug_mode(mode, directory=None, worker_mode=None):
+    global debug_mode, debug_dir, worker_debug_mode
+    if mode not in DEBUG_MODES:
+        raise ValueError(f"Unknown debug mode {mode!r}, use one of {DEBUG_MODES}")
+    if worker_mode is not None and worker_mode not in WORKER_DEBUG_MODES:
+        raise ValueError(f"Unknown worker debug mode {worker_mode!r}, use one of {WORKER_DEBUG_MODES}")
+    debug_mode = mode
+    if directory is not None:
+        debug_dir = directory
+    if worker_mode is not None:
+        worker_debug_mode = worker_mode
+
+# Prefix the next saved images with a name (e.g. the tray image), so the files of one image stay together
+def set_debug_context(name):
+    global debug_context
+    debug_context = os.path.splitext(os.path.basename(str(name)))[0]
+
+# Debug mode of the calling thread: debug_mode in the main thread, worker_debug_mode (or off) in the others
+def current_debug_mode():
+    if debug_mode == 'off' or threading.current_thread() is threading.main_thread():
+        return debug_mode
+    return worker_debug_mode
+
+# True when display_image does something in this thread, use it to skip work done only for debugging
+def debug_enabled():
+    return current_debug_mode() != 'off'
+
+def display_image(image, window_name="Image"):
+    mode = current_debug_mode()
+    if mode == 'off':
+        return
+    if image is None:
+        print(f"No image to display for {window_name}.")
+        return
+    # HighGUI windows only work from the main thread, worker threads can only save their images
+    if mode == 'disk':
+        save_image_async(image, window_name)
+        return
+
+    # Create a resizable window that fits in 1280x720
+    cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+    height, width = image.shape[:2]
+    scale = min(1.0, 1280 / width, 720 / height)
+    cv2.resizeWindow(window_name, int(width * scale), int(height * scale))
+    cv2.imshow(window_name, image)
+    cv2.waitKey(0)
+    cv2.destroyAllWindows()
+
+# Queue a copy of the image for the writer thread, the caller never waits for the encoding
+def save_image_async(image, window_name):
+    global image_counter, dropped_images
+    start_writer()
+    with writer_lock:
+        image_counter += 1
+        number = image_counter
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', window_name).strip('_') or 'image'
+    prefix = f"{debug_context}_" if debug_context else ''
+    path = os.path.join(debug_dir, f"{prefix}{number:06d}_{name}.png")
+    try:
+        # Copy because the caller usually keeps drawing on the same image
+        writer_queue.put_nowait((path, image.copy()))
+    except queue.Full:
+        dropped_images += 1
+
+def start_writer():
+    global writer_queue, writer_thread
+    with writer_lock:
+        if writer_thread is not None:
+            return
+        writer_queue = queue.Queue(maxsize=max_queued_images)
+        writer_thread = threading.Thread(target=write_images, name='debug-sink-writer', daemon=True)
+        writer_thread.start()
+        atexit.register(flush)
+
+def write_images():
+    while True:
+        path, image = writer_queue.get()
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            cv2.imwrite(path, image)
+        except Exception as error:
+            print(f"Debug sink could not write {path}: {error}")
+        finally:
+            writer_queue.task_done()
+
+# Wait until every queued image is written (called automatically at exit)
+def flush():
+    if writer_queue is not None:
+        writer_queue.join()
+    if dropped_images:
+        print(f"Debug sink dropped {dropped_images} images because the writer queue was full.")
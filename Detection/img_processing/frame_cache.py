@@ -0,0 +1,72 @@
+import cv2
+
+# cv2.rotate codes for 0, 90, 180 and 270 degrees counter-clockwise (same direction as rotate_image with a positive angle)
+ROTATE_CODES = [None, cv2.ROTATE_90_COUNTERCLOCKWISE, cv2.ROTATE_180, cv2.ROTATE_90_CLOCKWISE]
+
+# Rotate the image by a multiple of 90 degrees counter-clockwise without interpolation
+def rotate_image_quarter(image, quarter_turns):
+    code = ROTATE_CODES[quarter_turns % 4]
+    if code is None:
+        return image.copy()
+    return cv2.rotate(image, code)
+
+# One BGR frame plus every representation the stages derive from it (gray, HSV, brightened, blurred...)
+# Each representation is computed the first time a stage asks for it and then reused by the next stages
+class Frame:
+    def __init__(self, image):
+        self.image = image
+        self.cache = {}
+
+    # Return the cached value for key, computing it once with compute() if needed
+    def cached(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    # Drop every derived representation (call after changing self.image)
+    def invalidate(self):
+        self.cache.clear()
+
+    # Replace the image of the frame, the old representations are no longer valid
+    def set_image(self, image):
+        self.image = image
+        self.invalidate()
+
+    # Rotate the frame by a multiple of 90 degrees counter-clockwise, the cache is invalidated
+    def rotate(self, quarter_turns):
+        if quarter_turns % 4:
+            self.set_image(rotate_image_quarter(self.image, quarter_turns))
+
+    def gray(self):
+        return self.cached('gray', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+
+    def hsv(self):
+        return self.cached('hsv', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2HSV))
+
+    # HSV with the V channel increased by value (saturating at 255), same as increase_brightness before HSV2BGR
+    def brightened_hsv(self, value=50):
+        return self.cached(('brightened_hsv', value), lambda: cv2.add(self.hsv(), (0, 0, value, 0)))
+
+    # BGR image returned by increase_brightness(image, value)
+    def brightened(self, value=50):
+        return self.cached(('brightened', value), lambda: cv2.cvtColor(self.brightened_hsv(value), cv2.COLOR_HSV2BGR))
+
+    # GaussianBlur of the grayscale image (barcode detection)
+    def blurred_gray(self, ksize, sigma):
+        return self.cached(('blurred_gray', ksize, sigma), lambda: cv2.GaussianBlur(self.gray(), ksize, sigma))
+
+    # GaussianBlur of the brightened BGR image (tray and substrate detection)
+    def blurred_brightened(self, ksize, sigma, value=50):
+        return self.cached(('blurred_brightened', ksize, sigma, value),
+                           lambda: cv2.GaussianBlur(self.brightened(value), ksize, sigma))
+
+    # HSV of the blurred brightened image, this is the image the HSV ranges are applied on
+    def blurred_brightened_hsv(self, ksize, sigma, value=50):
+        return self.cached(('blurred_brightened_hsv', ksize, sigma, value),
+                           lambda: cv2.cvtColor(self.blurred_brightened(ksize, sigma, value), cv2.COLOR_BGR2HSV))
+
+# Wrap a plain image into a Frame, a Frame is returned as is so the stages can share its cache
+def as_frame(image):
+    if isinstance(image, Frame):
+        return image
+    return Frame(image)
@@ -1,35 +1,18 @@
 import cv2
 import numpy as np
 import time
+from frame_cache import Frame, as_frame
+from debug_sink import display_image
+from image_loader import load_image
+from station_profile import stage_settings
 
-# Display an image in a resizable window
-def display_image(image, window_name="Image"):
-    # Ensure if there is an image in the path directory
-    if image is not None:
-        # Create a named window with the ability to resize
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-        
-        # Display the image with the specified window name
-        cv2.imshow(window_name, image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print("No image to display.")
-
-# Load an image from the specified path and return it.
-def load_image(image_path, width=1280, height=720):
-    # Load the image
-    image = cv2.imread(image_path)
-    
-    # Check if the image was successfully loaded
-    if image is None:
-        print(f"Error: No image found at {image_path}")
-        return None
-    
-    # Resize the image to the specified dimensions
-    resized_image = cv2.resize(image, (width, height))
-    
-    return resized_image
+# Defaults of the barcode stage, a station profile (station_profile.py) can override any of them
+BARCODE_SETTINGS = {
+    'blur_ksize': 3,        # GaussianBlur((ksize, ksize), sigma) of the grayscale image
+    'blur_sigma': 3,
+    'canny_lower': 0.7,     # Canny thresholds as factors of the median of the blurred image
+    'canny_upper': 1.3,
+}
 
 # Check if the entire bounding box is in the bottom half of the image
 def is_in_bottom_half(polygon, img_height):
@@ -59,50 +42,111 @@ def rotate_image(image, angle):
     rotated_image = cv2.warpAffine(image, rotation_matrix, (new_width, new_height))
     return rotated_image
 
+# Map polygon points into the frame rotated by a multiple of 90 degrees counter-clockwise
+def rotate_polygon_quarter(polygon, quarter_turns, width, height):
+    points = polygon.reshape(-1, 2).copy()
+    for _ in range(quarter_turns % 4):
+        # One counter-clockwise quarter turn: (x, y) -> (y, width - 1 - x), then width and height swap
+        points = np.stack([points[:, 1], width - 1 - points[:, 0]], axis=1)
+        width, height = height, width
+    return points.reshape(-1, 1, 2).astype(polygon.dtype)
+
+# Canny thresholds of the barcode stage, factors of the median of the blurred grayscale image
+def barcode_canny_thresholds(blurred_image, settings):
+    med_val = np.median(blurred_image)
+    lower = int(max(0, settings['canny_lower'] * med_val))
+    upper = int(min(255, settings['canny_upper'] * med_val))
+    return lower, upper
+
+# Find the largest barcode-like contour in the image (or Frame) and approximate it with a polygon
+# profile=None uses the station profile loaded at startup
+def find_barcode_polygon(image, min_area, max_area, profile=None):
+    frame = as_frame(image)
+    # Make grayscale and blur it to reduce noise (1, 1) or (3, 3) or (5, 5)....
+    # Can change the last number, it is a sigma which help in blurring more details
+    # (both are cached on the frame so they are computed once per frame)
+    settings = stage_settings('barcode', BARCODE_SETTINGS, profile)
+    ksize = settings['blur_ksize']
+
+    blurred_image = frame.blurred_gray((ksize, ksize), settings['blur_sigma'])
+
+    # Apply Canny edge detection
+    lower, upper = barcode_canny_thresholds(blurred_image, settings)
+    edges = cv2.Canny(blurred_image, threshold1=lower, threshold2=upper)
+
+    # Find contours in the edge-detected image
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    valid_contours = [cnt for cnt in contours if min_area < cv2.contourArea(cnt) < max_area]
+    if not valid_contours:
+        return None
+
+    # Approximate the largest contour with a polygon
+    largest_contour = max(valid_contours, key=cv2.contourArea)
+    epsilon = 0.02 * cv2.arcLength(largest_contour, True)
+    return cv2.approxPolyDP(largest_contour, epsilon, True)
+
 # Detect and locate the bounding box
-def get_barcode(image, min_area, max_area):
-    rotated_image = image.copy()
+# image can be a plain image or a Frame, a Frame is rotated in place so the next stages reuse it
+# single_pass=True detects once on the original frame and resolves the orientation on the polygon coordinates,
+# single_pass=False keeps the old behaviour of rotating and re-detecting up to four times
+# crop=False skips the masked crop (returned as None) when the polygon is rectified with warp_polygon_to_rectangle
+# stats (optional dict) receives 'quarter_turns', the number of 90 degree rotations applied (None if not found)
+# profile (optional) replaces the station profile loaded at startup
+def get_barcode(image, min_area, max_area, single_pass=True, crop=True, stats=None, profile=None):
+    # Work on a copy of a plain image so the caller's image is never returned or modified
+    frame = image if isinstance(image, Frame) else Frame(image.copy())
+    if single_pass:
+        return get_barcode_single_pass(frame, min_area, max_area, crop, stats, profile)
+
+    rotated_image = frame.image
     height = rotated_image.shape[0]
+    if stats is not None:
+        stats['quarter_turns'] = None
     
-    for _ in range(4):  # Rotate up to 270 degrees (4 rotations of 90 degrees)
-        output_image = rotated_image.copy()
-        
-        # Extract the blue channel Blue=0 Green=1 Red=2 or either make grayscale
-        #img_channeled = output_image[:, :, 2]
-        gray_image = cv2.cvtColor(output_image, cv2.COLOR_BGR2GRAY)
-        
-        # Blur the blue channel to reduce noise (1, 1) or (3, 3) or (5, 5)....
-        # Can change the last number, it is a sigma which help in blurring more details
-        blurred_image = cv2.GaussianBlur(gray_image, (3, 3), 3)
-        
-        # Apply Canny edge detection
-        med_val = np.median(blurred_image)
-        lower = int(max(0, 0.7 * med_val))
-        upper = int(min(255, 1.3 * med_val))
-        edges = cv2.Canny(blurred_image, threshold1=lower, threshold2=upper)
+    for quarter_turns in range(4):  # Rotate up to 270 degrees (4 rotations of 90 degrees)
+        approx_polygon = find_barcode_polygon(frame, min_area, max_area, profile)
         
-        # Find contours in the edge-detected image
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        valid_contours = [cnt for cnt in contours if min_area < cv2.contourArea(cnt) < max_area]
-        valid_contours = sorted(valid_contours, key=cv2.contourArea, reverse=True)
-        
-        # Draw a polygon around the largest contour if available
-        if valid_contours:
-            epsilon = 0.02 * cv2.arcLength(valid_contours[0], True)
-            approx_polygon = cv2.approxPolyDP(valid_contours[0], epsilon, True)
-            
-            # Check if the bounding box is entirely within the bottom half of the image
-            if is_in_bottom_half(approx_polygon, height):
-                cropped_polygon = crop_polygon(rotated_image, approx_polygon)
-                return output_image, approx_polygon, cropped_polygon
+        # Check if the bounding box is entirely within the bottom half of the image
+        if approx_polygon is not None and is_in_bottom_half(approx_polygon, height):
+            cropped_polygon = crop_polygon(rotated_image, approx_polygon) if crop else None
+            if stats is not None:
+                stats['quarter_turns'] = quarter_turns
+            return rotated_image, approx_polygon, cropped_polygon
         
         # Rotate the image by 90 degrees if the bounding box is not in the bottom half
         print("Rotating image to adjust bounding box position.")
         rotated_image = rotate_image(rotated_image, 90)
+        frame.set_image(rotated_image)
     
     print("No valid bounding box found or unable to position bounding box in bottom half.")
     return rotated_image, None, None
 
+# Detect the barcode once, pick the quarter turn that puts it in the bottom half and rotate the frame only once
+def get_barcode_single_pass(frame, min_area, max_area, crop=True, stats=None, profile=None):
+    height, width = frame.image.shape[:2]
+    if stats is not None:
+        stats['quarter_turns'] = None
+    approx_polygon = find_barcode_polygon(frame, min_area, max_area, profile)
+    if approx_polygon is None:
+        print("No valid bounding box found or unable to position bounding box in bottom half.")
+        return frame.image, None, None
+
+    for quarter_turns in range(4):  # Try 0, 90, 180 and 270 degrees on the polygon only
+        rotated_height = height if quarter_turns % 2 == 0 else width
+        rotated_polygon = rotate_polygon_quarter(approx_polygon, quarter_turns, width, height)
+        if is_in_bottom_half(rotated_polygon, rotated_height):
+            if quarter_turns:
+                print(f"Rotating image by {quarter_turns * 90} degrees to adjust bounding box position.")
+            frame.rotate(quarter_turns)
+            if stats is not None:
+                stats['quarter_turns'] = quarter_turns
+            cropped_polygon = crop_polygon(frame.image, rotated_polygon) if crop else None
+            return frame.image, rotated_polygon, cropped_polygon
+
+    # Barcode crosses the middle of the frame in every orientation
+    print("No valid bounding box found or unable to position bounding box in bottom half.")
+    return frame.image, None, None
+
 # Crop the polygonal area from the image
 def crop_polygon(image, polygon):
     # Create a black mask of the same size as the image
@@ -1,62 +1,57 @@
 import cv2
 import numpy as np
+from frame_cache import as_frame
+from hsv_fallback import first_accepted_range
+from debug_sink import display_image, debug_enabled
+from image_loader import load_image
+from station_profile import stage_settings
 
-def display_image(image, window_name="Image"):
-    if image is not None:
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-        cv2.resizeWindow(window_name, 1280, 720)
-        cv2.imshow(window_name, image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print("No image to display.")
+# HSV ranges for green and yellow substrates, tried in this order (lower, upper)
+SUBSTRATE_HSV_RANGES = [
+    ((5, 30, 30), (95, 255, 255)),    # primary range
+    ((10, 40, 40), (90, 255, 255)),   # 1st fallback
+    ((15, 50, 50), (85, 255, 255)),   # 2nd fallback
+]
 
-def load_image(image_path, width=1280, height=720):
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"Error: No image found at {image_path}")
-        return None
-    resized_image = cv2.resize(image, (width, height))
-    return resized_image
+# Defaults of the substrate stage, a station profile (station_profile.py) can override any of them
+SUBSTRATE_SETTINGS = {
+    'hsv_ranges': SUBSTRATE_HSV_RANGES,
+    'brightness': 50,           # added to V before the blur
+    'blur_ksize': 5,            # GaussianBlur((ksize, ksize), 0)
+    'dilate_iterations': 2,     # merges the nearby areas of one substrate
+    'finder': 'contours',       # 'components' (connectedComponentsWithStats) has a flat cost, better for very noisy masks
+}
 
-def processing_for_substrates(image, min_width=0, min_height=500000, epsilon_factor=0.02):
-    output_image = image.copy()
+def processing_for_substrates(image, min_width=0, min_height=500000, epsilon_factor=0.02, max_workers=None, display=True, stats=None, profile=None):
+    # image can be a plain image or a Frame shared with the other stages
+    # display=False skips the final window, stats (optional dict) receives the chosen HSV range and the substrate count
+    # profile=None uses the station profile loaded at startup
+    frame = as_frame(image)
+    settings = stage_settings('substrate', SUBSTRATE_SETTINGS, profile)
+    output_image = frame.image.copy()
 
-    # Increase brightness of the image
-    brightened_image = increase_brightness(output_image, value=50)
+    # Increase brightness of the image, apply Gaussian Blur to the brightened image to reduce noise
+    # and convert to HSV to isolate green, yellow, and dark green regions (cached on the frame)
+    ksize = settings['blur_ksize']
+    hsv_image = frame.blurred_brightened_hsv((ksize, ksize), 0, value=settings['brightness'])
     
-    # Apply Gaussian Blur to the brightened image to reduce noise
-    blurred_image = cv2.GaussianBlur(brightened_image, (5, 5), 0)
+    # Evaluate the primary range and both fallbacks from one HSV image,
+    # the first range (in hsv_ranges order) with at least 6 substrates wins like the old cascade
+    range_index, substrates = first_accepted_range(
+        hsv_image, settings['hsv_ranges'],
+        lambda color_mask: find_bounding_boxes(None, color_mask, min_width, min_height,
+                                               dilate_iterations=settings['dilate_iterations'], finder=settings['finder']),
+        lambda boxes: len(boxes) >= 6,
+        max_workers=max_workers)
+    if stats is not None:
+        stats['substrate_hsv_range'] = range_index   # index in the hsv_ranges of the profile, None if no range found 6 substrates
+        stats['substrate_count'] = len(substrates)
+    if range_index:
+        print(f"Fewer than 6 substrates with the primary HSV range, used fallback range {range_index}.")
 
-    # Convert to HSV and create mask to isolate green, yellow, and dark green regions
-    hsv_image = cv2.cvtColor(blurred_image, cv2.COLOR_BGR2HSV)
-    
-    # Primary green and yellow HSV range
-    lower_color = np.array([5, 30, 30])
-    upper_color = np.array([95, 255, 255])
-    color_mask = cv2.inRange(hsv_image, lower_color, upper_color)
-    '''display_image(color_mask, "Primary Green and Yellow Mask")'''
-    
-    # Find bounding boxes for substrates
-    substrates = find_bounding_boxes(output_image.copy(), color_mask, min_width, min_height, "Primary Range Bounding Boxes")
-    
-    # First fallback HSV range if fewer than 6 substrates are detected
-    if len(substrates) < 6:
-        print("Trying alternative HSV range for green and yellow (1st fallback).")
-        lower_color = np.array([10, 40, 40])
-        upper_color = np.array([90, 255, 255])
-        color_mask = cv2.inRange(hsv_image, lower_color, upper_color)
-        '''display_image(color_mask, "Fallback Green and Yellow Mask (1st fallback)")'''
-        substrates = find_bounding_boxes(output_image.copy(), color_mask, min_width, min_height, "1st Fallback Range Bounding Boxes")
-
-    # Second fallback HSV range if fewer than 6 substrates are still detected
-    if len(substrates) < 6:
-        print("Trying another alternative HSV range for green and yellow (2nd fallback).")
-        lower_color = np.array([15, 50, 50])
-        upper_color = np.array([85, 255, 255])
-        color_mask = cv2.inRange(hsv_image, lower_color, upper_color)
-        '''display_image(color_mask, "Fallback Green and Yellow Mask (2nd fallback)")'''
-        substrates = find_bounding_boxes(output_image.copy(), color_mask, min_width, min_height, "2nd Fallback Range Bounding Boxes")
+    # Draw the bounding boxes of the chosen range
+    for (x, y, w, h) in substrates.tolist():
+        cv2.rectangle(output_image, (x, y), (x + w, y + h), (0, 0, 255), 2)
 
     # Final check for exactly 6 substrates
     if len(substrates) == 6:
@@ -64,30 +59,74 @@ def processing_for_substrates(image, min_width=0, min_height=500000, epsilon_fac
     else:
         print(f"Detected {len(substrates)} substrates. Adjust parameters or check image quality.")
 
-    display_image(output_image, "Final Detected Substrates with Bounding Boxes")
+    if display:
+        display_image(output_image, "Final Detected Substrates with Bounding Boxes")
     return output_image
 
-def find_bounding_boxes(output_image, mask, min_width, min_height, window_name="Bounding Boxes"):
+def find_bounding_boxes(output_image, mask, min_width, min_height, window_name="Bounding Boxes", dilate_iterations=2,
+                        min_area=0, finder='contours'):
     # Apply dilation to the mask to merge nearby areas
-    dilated_mask = cv2.dilate(mask, None, iterations=2)
-    display_image(dilated_mask, "Dilated Mask")
-
-    # Find contours directly on the dilated binary mask
-    contours, _ = cv2.findContours(dilated_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    bounding_boxes = []
-    for cnt in contours:
-        x, y, w, h = cv2.boundingRect(cnt)
-        aspect_ratio = w / float(h)
-        # Only select boxes with minimum width, height, and approximately square shape
-        if w > min_width and h > min_height and 0.8 < aspect_ratio < 1.2:
-            # Draw bounding box on output image
+    dilated_mask = cv2.dilate(mask, None, iterations=dilate_iterations)
+    # This runs on the HSV range threads, the debug image is only produced when debugging
+    if debug_enabled():
+        display_image(dilated_mask, "Dilated Mask")
+
+    # Bounding box [x, y, w, h] and area of every outer area of the dilated mask, as arrays (no Python loop per area)
+    if finder == 'components':
+        boxes, areas = component_boxes(dilated_mask)
+    elif finder == 'contours':
+        # Find contours directly on the dilated binary mask
+        contours, _ = cv2.findContours(dilated_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = contour_boxes(contours)
+        areas = None
+    else:
+        raise ValueError(f"Unknown substrate finder {finder!r}, use 'contours' or 'components'")
+
+    # Only select boxes with minimum width, height, and approximately square shape
+    widths, heights = boxes[:, 2], boxes[:, 3]
+    aspect_ratios = widths / heights.astype(np.float64)
+    keep = (widths > min_width) & (heights > min_height) & (aspect_ratios > 0.8) & (aspect_ratios < 1.2)
+    if min_area > 0:
+        if areas is None:
+            # Contour areas are only computed for the few boxes left
+            areas = np.zeros(len(boxes))
+            areas[keep] = [cv2.contourArea(contours[index]) for index in np.flatnonzero(keep)]
+        keep &= areas >= min_area
+    bounding_boxes = boxes[keep]    # (N, 4) array of x, y, w, h
+
+    # Draw bounding box on output image (None when called from the HSV range threads)
+    if output_image is not None:
+        for x, y, w, h in bounding_boxes.tolist():
             cv2.rectangle(output_image, (x, y), (x + w, y + h), (0, 0, 255), 2)
-            bounding_boxes.append((x, y, w, h))
 
     # Display bounding boxes for the current HSV range
     '''display_image(output_image, window_name)'''
     return bounding_boxes
 
+# Bounding boxes (N, 4) of the contours, same as cv2.boundingRect on every contour but computed in one NumPy pass
+def contour_boxes(contours):
+    if not contours:
+        return np.zeros((0, 4), dtype=np.int32)
+    lengths = np.fromiter(map(len, contours), dtype=np.intp, count=len(contours))
+    points = np.concatenate(contours).reshape(-1, 2)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    mins = np.minimum.reduceat(points, starts)
+    maxs = np.maximum.reduceat(points, starts)
+    return np.column_stack([mins, maxs - mins + 1]).astype(np.int32)
+
+# Bounding boxes (N, 4) and pixel areas (N,) of the outer areas of a binary mask from cv2.connectedComponentsWithStats
+# The holes are filled first, so an area inside the hole of another one is not reported (same as RETR_EXTERNAL contours)
+# Its cost does not depend on the number of areas, so it is faster than the contours on very noisy masks only
+def component_boxes(mask):
+    # Background reachable from the border (4-connected, like the holes of 8-connected contours), the rest is a hole
+    padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    outside = padded.copy()
+    cv2.floodFill(outside, None, (0, 0), 255)
+    filled = cv2.bitwise_or(padded, cv2.bitwise_not(outside))[1:-1, 1:-1]
+    # One row [x, y, w, h, area] per 8-connected area, row 0 is the background
+    _, _, stats, _ = cv2.connectedComponentsWithStats(filled, connectivity=8)
+    return stats[1:, :4], stats[1:, cv2.CC_STAT_AREA]
+
 def increase_brightness(image, value=50):
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
     h, s, v = cv2.split(hsv)
@@ -1,85 +1,70 @@
 import cv2
 import numpy as np
 import time
+from frame_cache import as_frame
+from hsv_fallback import first_accepted_range
+from debug_sink import display_image
+from image_loader import load_image
+from station_profile import stage_settings
 
-def display_image(image, window_name="Image"):
-    if image is not None:
-        # Create a resizable window
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-        
-        # Resize window to a fixed dimension (e.g., 1280x720)
-        cv2.resizeWindow(window_name, 1280, 720)
-        
-        # Display the image
-        cv2.imshow(window_name, image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print("No image to display.")
+# HSV ranges for gray, tried in this order (lower, upper)
+# Gray doesn’t have a specific hue so 0 to 180
+# Saturation is low because gray tones have little to no color so 0 to 60
+# Gray can have a wide range of brightness values. Here, a range of 60 to 180 is used, which includes dark to light gray tones.)
+#*** adjust until get rid of metal noise
+TRAY_HSV_RANGES = [
+    ((0, 0, 60), (180, 60, 180)),   # initial range
+    ((0, 0, 60), (180, 60, 140)),   # darker gray only
+    ((0, 0, 60), (180, 20, 180)),   # less saturated gray only
+]
 
-def load_image(image_path, width=1280, height=720):
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"Error: No image found at {image_path}")
-        return None
-    resized_image = cv2.resize(image, (width, height))
-    return resized_image
+# Defaults of the tray stage, a station profile (station_profile.py) can override any of them
+TRAY_SETTINGS = {
+    'hsv_ranges': TRAY_HSV_RANGES,
+    'brightness': 50,       # added to V before the blur (increase_brightness)
+    'blur_sigma': 1,        # GaussianBlur((0, 0), sigma)
+    'canny_lower': 0.7,     # Canny thresholds as factors of the median of the mask
+    'canny_upper': 1.3,
+}
 
-def get_tray(image, min_area, epsilon_factor=0.02):
-    output_image = image.copy()
-    
-    # Increase brightness of the image
-    brightened_image = increase_brightness(output_image, value=50)
+def get_tray(image, min_area, epsilon_factor=0.02, max_workers=None, stats=None, profile=None):   #image can be a plain image or a Frame shared with the other stages
+    frame = as_frame(image)
+    settings = stage_settings('tray', TRAY_SETTINGS, profile)    # profile=None uses the station profile loaded at startup
+    output_image = frame.image.copy()
     
-    # Apply Gaussian Blur to the brightened image to reduce noise
-    blurred_image = cv2.GaussianBlur(brightened_image, (0, 0), 1)
-    '''display_image(blurred_image,'blurred_image')'''
+    # Increase brightness of the image (same as increase_brightness(image, value=50)),
+    # apply Gaussian Blur to the brightened image to reduce noise
+    # and convert the image to HSV color space for processing, every step is cached on the frame
+    hsv_image = frame.blurred_brightened_hsv((0, 0), settings['blur_sigma'], value=settings['brightness'])
+    '''display_image(frame.blurred_brightened((0, 0), settings['blur_sigma'], value=settings['brightness']),'blurred_image')'''
     
-    # Convert the image to HSV color space for processing
-    hsv_image = cv2.cvtColor(blurred_image, cv2.COLOR_BGR2HSV)
-    
-    # Define HSV color range for gray
-    # Gray doesn’t have a specific hue so 0 to 180
-    # Saturation is low because gray tones have little to no color so 0 to 60
-    # Gray can have a wide range of brightness values. Here, a range of 60 to 180 is used, which includes dark to light gray tones.)
-    #*** adjust until get rid of metal noise
-    lower_gray = np.array([0, 0, 60])
-    upper_gray = np.array([180, 60, 180])
-
-    # Create a mask that isolates only gray regions
-    gray_mask = cv2.inRange(hsv_image, lower_gray, upper_gray)
-    '''display_image(gray_mask,'gray_mask')'''
-    detected_polygons = find_polygons(output_image, gray_mask, min_area, epsilon_factor)
+    # Evaluate every HSV range from one HSV image, the first range (in hsv_ranges order) that finds a tray wins
+    range_index, detected_polygons = first_accepted_range(
+        hsv_image, settings['hsv_ranges'],
+        lambda gray_mask: find_polygons(None, gray_mask, min_area, epsilon_factor,
+                                        settings['canny_lower'], settings['canny_upper']),
+        lambda polygons: len(polygons) > 0,
+        max_workers=max_workers)
+    if stats is not None:
+        stats['tray_hsv_range'] = range_index   # index in the hsv_ranges of the profile, None if no range found a tray
     
-    # If no tray detected, try with a modified HSV range
-    if not detected_polygons:
-        print("No tray detected with initial HSV range, trying alternative range.")
-        lower_gray = np.array([0, 0, 60])
-        upper_gray = np.array([180, 60, 140])
-        gray_mask = cv2.inRange(hsv_image, lower_gray, upper_gray)
-        '''display_image(gray_mask,'gray_mask')'''
-        detected_polygons = find_polygons(output_image, gray_mask, min_area, epsilon_factor)
-        
-    # If no tray detected, try with a modified HSV range
-    if not detected_polygons:
-        print("No tray detected with initial HSV range, trying alternative range.")
-        lower_gray = np.array([0, 0, 60])
-        upper_gray = np.array([180, 20, 180])
-        gray_mask = cv2.inRange(hsv_image, lower_gray, upper_gray)
-        '''display_image(gray_mask,'gray_mask')'''
-        detected_polygons = find_polygons(output_image, gray_mask, min_area, epsilon_factor)
-        
+    if range_index:
+        print(f"No tray detected with initial HSV range, detected with alternative range {range_index}.")
     if detected_polygons:
+        cv2.polylines(output_image, detected_polygons, isClosed=True, color=(0, 0, 255), thickness=2)
         return output_image, detected_polygons
     else:
         print("No 4-sided gray polygonal objects detected with either HSV range.")
     return output_image, None
 
-def find_polygons(output_image, mask, min_area, epsilon_factor):        #use in bounding_box function
-    # Apply Canny edge detection
+# Canny thresholds as factors of the median of the mask
+def mask_canny_thresholds(mask, canny_lower=0.7, canny_upper=1.3):
     med_val = np.median(mask)
-    lower = int(max(0, 0.7 * med_val))
-    upper = int(min(255, 1.3 * med_val))
+    return int(max(0, canny_lower * med_val)), int(min(255, canny_upper * med_val))
+
+def find_polygons(output_image, mask, min_area, epsilon_factor, canny_lower=0.7, canny_upper=1.3):        #use in bounding_box function (output_image=None to skip drawing)
+    # Apply Canny edge detection
+    lower, upper = mask_canny_thresholds(mask, canny_lower, canny_upper)
     edges = cv2.Canny(mask, lower, upper)
     '''display_image(edges, 'Canny')'''
 
@@ -96,7 +81,8 @@ def find_polygons(output_image, mask, min_area, epsilon_factor):        #use in
             epsilon = epsilon_factor * cv2.arcLength(cnt, True)
             approx_polygon = cv2.approxPolyDP(cnt, epsilon, True)
             if len(approx_polygon) == 4:
-                cv2.polylines(output_image, [approx_polygon], isClosed=True, color=(0, 0, 255), thickness=2)
+                if output_image is not None:
+                    cv2.polylines(output_image, [approx_polygon], isClosed=True, color=(0, 0, 255), thickness=2)
                 detected_polygons.append(approx_polygon)
     return detected_polygons
 
@@ -0,0 +1,66 @@
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared thread pool for scoring the HSV candidates (OpenCV releases the GIL so the candidates really run in parallel)
+executor = None
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+    return executor
+
+# Build the masks of all HSV ranges in one vectorized pass over the HSV image
+# Every channel goes through one lookup table whose bit i is set when the value is inside range i,
+# so ANDing the three lookups gives, for each pixel, the set of ranges it belongs to (up to 8 ranges)
+def build_range_bits(hsv_image, hsv_ranges):
+    if len(hsv_ranges) > 8:
+        raise ValueError("At most 8 HSV ranges can be evaluated together.")
+    values = np.arange(256)
+    channels = cv2.split(hsv_image)
+    range_bits = None
+    for channel in range(3):
+        table = np.zeros(256, dtype=np.uint8)
+        for index, (lower, upper) in enumerate(hsv_ranges):
+            # Same inclusive bounds as cv2.inRange
+            table[(values >= lower[channel]) & (values <= upper[channel])] |= 1 << index
+        channel_bits = cv2.LUT(channels[channel], table)
+        range_bits = channel_bits if range_bits is None else cv2.bitwise_and(range_bits, channel_bits)
+    return range_bits
+
+# Extract the 0/255 mask of one range from the packed range bits (equal to cv2.inRange with that range)
+def range_mask(range_bits, index):
+    return cv2.compare(cv2.bitwise_and(range_bits, 1 << index), 0, cv2.CMP_GT)
+
+# Evaluate every HSV range on the same HSV image and return (index, result) of the first range, in list order,
+# whose result is accepted. evaluate(mask) must not modify shared state because the ranges run concurrently.
+# If no range is accepted the index is None and the result of the last range is returned (same as the old cascade).
+# max_workers=1 evaluates the ranges one after another and stops at the first accepted one.
+def first_accepted_range(hsv_image, hsv_ranges, evaluate, accept, max_workers=None):
+    range_bits = build_range_bits(hsv_image, hsv_ranges)
+
+    if max_workers == 1 or len(hsv_ranges) == 1:
+        result = None
+        for index in range(len(hsv_ranges)):
+            result = evaluate(range_mask(range_bits, index))
+            if accept(result):
+                return index, result
+        return None, result
+
+    pool = get_executor() if max_workers is None else ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [pool.submit(lambda i=index: evaluate(range_mask(range_bits, i))) for index in range(len(hsv_ranges))]
+        # Results are read in list order so the chosen range never depends on thread timing
+        result = None
+        for index, future in enumerate(futures):
+            result = future.result()
+            if accept(result):
+                for pending in futures[index + 1:]:
+                    pending.cancel()
+                return index, result
+        return None, result
+    finally:
+        if pool is not executor:
+            pool.shutdown(wait=False)
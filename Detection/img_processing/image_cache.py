@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from image_loader import load_image
+
+# Pre-decoded image cache for repeated experiments
+#   python image_cache.py ../labelImg_xml_and_crop/Trays_and_annotate_all -o tray_cache
+#   cache = ImageCache('tray_cache'); image = cache.get('.../tray (1).jpg', 1280, 720)
+# The images are decoded and resized once (same load_image as the pipeline) and stored back to back in one uint8 file,
+# index.json keeps the shape and byte offset of every image. The file is opened with np.memmap, so get() returns a
+# read-only NumPy view without decoding or copying, and the worker processes share the same pages of the OS page cache.
+DATA_FILE = 'images.u8'
+INDEX_FILE = 'index.json'
+ALIGNMENT = 64      # every image starts on a 64 byte boundary (cache line / SIMD friendly)
+
+# Key of an image in the index, the same file reached by another relative path gets the same key
+def cache_key(image_path):
+    return os.path.normcase(os.path.abspath(image_path))
+
+# Size and modification time of the source file, an entry is stale when they change
+def source_signature(image_path):
+    stat = os.stat(image_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# Decode every image once and write the cache (width/height None keeps the decoded size), returns the index
+def build_cache(image_paths, cache_dir, width=1280, height=720, workers=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    def decode(image_path):
+        if width is None or height is None:
+            return cv2.imread(image_path)
+        return load_image(image_path, width, height)
+
+    # Decode in threads (OpenCV releases the GIL) but yield in input order, with at most 2 * workers images submitted
+    # ahead (executor.map would submit the whole dataset at once and keep every decoded image waiting in memory)
+    workers = workers or min(8, os.cpu_count() or 1)
+    def decoded_images(executor):
+        pending = collections.deque()
+        for image_path in image_paths:
+            pending.append((image_path, executor.submit(decode, image_path)))
+            if len(pending) >= 2 * workers:
+                image_path, future = pending.popleft()
+                yield image_path, future.result()
+        while pending:
+            image_path, future = pending.popleft()
+            yield image_path, future.result()
+
+    # Rebuilding over an old cache: remove its index first, so the old offsets are never read against the new data,
+    # then write both files under temporary names and move them in place (data first, index last)
+    data_path, index_path = os.path.join(cache_dir, DATA_FILE), os.path.join(cache_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    entries = {}
+    offset = 0
+    with open(data_path + '.tmp', 'wb') as data_file, ThreadPoolExecutor(max_workers=workers) as executor:
+        for image_path, image in decoded_images(executor):
+            if image is None:
+                print(f"Skipping {image_path}: cannot decode")
+                continue
+            padding = -offset % ALIGNMENT
+            data_file.write(b'\0' * padding)
+            offset += padding
+            image = np.ascontiguousarray(image, dtype=np.uint8)
+            data_file.write(image.tobytes())
+            entries[cache_key(image_path)] = {'offset': offset, 'shape': list(image.shape),
+                                              'source': source_signature(image_path)}
+            offset += image.nbytes
+
+    index = {'version': 1, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'width': width, 'height': height,
+             'bytes': offset, 'entries': entries}
+    os.replace(data_path + '.tmp', data_path)
+    # The index is written last, so a cache interrupted while writing is never opened
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    os.replace(index_path + '.tmp', index_path)
+    return index
+
+class ImageCache:
+    def __init__(self, cache_dir, check_source=True):
+        self.cache_dir = cache_dir
+        self.check_source = check_source    # False skips the os.stat of the source (e.g. archives on a slow network drive)
+        with open(os.path.join(cache_dir, INDEX_FILE), encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.entries = self.index['entries']
+        self.data = None
+        if self.index['bytes'] > 0:
+            self.data = np.memmap(os.path.join(cache_dir, DATA_FILE), dtype=np.uint8, mode='r', shape=(self.index['bytes'],))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, image_path):
+        return cache_key(image_path) in self.entries
+
+    # Zero-copy read-only view of the cached image, None if it is not cached, stale or cached at another size
+    # (copy() the view before drawing on it)
+    def get(self, image_path, width=None, height=None):
+        entry = self.entries.get(cache_key(image_path))
+        if entry is None:
+            return None
+        if width is not None and height is not None and (self.index['width'], self.index['height']) != (width, height):
+            return None
+        if self.check_source:
+            try:
+                if source_signature(image_path) != entry['source']:
+                    return None
+            except OSError:
+                return None
+        shape = tuple(entry['shape'])
+        return self.data[entry['offset']:entry['offset'] + int(np.prod(shape))].reshape(shape)
+
+    # Same as load_image, from the cache when possible (a view, not a copy) and decoded otherwise
+    def load_image(self, image_path, width=1280, height=720):
+        image = self.get(image_path, width, height)
+        if image is None:
+            image = load_image(image_path, width, height)
+        return image
+
+# One ImageCache per process and directory (the batch workers open it once, not once per image)
+open_caches = {}
+
+def open_cache(cache_dir):
+    if cache_dir not in open_caches:
+        open_caches[cache_dir] = ImageCache(cache_dir)
+    return open_caches[cache_dir]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Decode a dataset once into a memory-mapped image cache.")
+    parser.add_argument('inputs', nargs='+', help="Image files, directories or glob patterns")
+    parser.add_argument('-o', '--cache-dir', required=True, help="Directory of the cache (images.u8 + index.json)")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--native-size', action='store_true', help="Keep the decoded size instead of resizing to width x height")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Decoding threads")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    from batch_process import collect_images
+    args = parse_args(argv)
+    image_paths = collect_images(args.inputs)
+    if not image_paths:
+        print("No images found.")
+        return 1
+    width, height = (None, None) if args.native_size else (args.width, args.height)
+    start_time = time.time()
+    index = build_cache(image_paths, args.cache_dir, width, height, args.workers)
+    print(f"Cached {len(index['entries'])} images ({index['bytes'] / 1e6:.1f} MB) in {time.time() - start_time:.2f} seconds "
+          f"to {args.cache_dir}")
+    return 0
+
+# Example: python image_cache.py ../labelImg_xml_and_crop/Trays_and_annotate_all -o tray_cache,
+# then python batch_process.py ../labelImg_xml_and_crop/Trays_and_annotate_all --image-cache tray_cache
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import os
+import struct
+
+import cv2
+
+# Decode-time downscale flags of cv2.imread, libjpeg scales the DCT blocks so the full image is never decoded
+REDUCED_COLOR_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+# Largest reduction load_image uses: on 6000x4000 station photos a 1/4 decode moved tray corners by up to 17 px and lost
+# a tray, raise it only when benchmark_pipeline.py --reduced-decode gives the same detections as the full decode
+MAX_REDUCTION = 2
+JPEG_EXTENSIONS = ('.jpg', '.jpeg', '.jpe', '.jfif')
+# Pre-decoded cache built by image_cache.py, used by every load_image when DETECTION_IMAGE_CACHE is set
+image_cache_dir = os.environ.get('DETECTION_IMAGE_CACHE')
+
+# (width, height) of a JPEG from its SOF marker, without decoding it (None if the header cannot be read)
+def read_jpeg_size(image_path):
+    with open(image_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            if f.read(1) != b'\xff':
+                return None
+            # Fill bytes (0xFF repeated) may come before the marker code
+            code = f.read(1)
+            while code == b'\xff':
+                code = f.read(1)
+            if not code:
+                return None
+            code = code[0]
+            if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+                continue    # markers without a length
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack('>H', length_bytes)[0]
+            # SOF0..SOF15 except DHT (C4), JPG (C8) and DAC (CC): precision, height, width
+            if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                data = f.read(5)
+                if len(data) < 5:
+                    return None
+                height, width = struct.unpack('>HH', data[1:5])
+                return width, height
+            if code == 0xDA:
+                return None     # start of scan before any SOF, not a valid JPEG
+            f.seek(length - 2, 1)
+
+# Largest decode-time reduction (8, 4, 2 or 1, at most max_factor) that still gives at least width x height pixels
+def reduction_factor(source_size, width, height, max_factor=8):
+    source_width, source_height = source_size
+    for factor in (8, 4, 2):
+        if factor <= max_factor and width * factor <= source_width and height * factor <= source_height:
+            return factor
+    return 1
+
+# Load an image from the specified path and resize it to width x height
+# reduced_decode=True (opt-in) decodes a large JPEG directly at 1/2 of its size (MAX_REDUCTION) when that is still at
+# least the target size, and only the remaining resize is done afterwards; the default decodes in full as before
+def load_image(image_path, width=1280, height=720, reduced_decode=False):
+    if image_cache_dir:
+        from image_cache import open_cache
+        cached = open_cache(image_cache_dir).get(image_path, width, height)
+        if cached is not None:
+            return cached.copy()    # callers may draw on the image, the cache itself stays read-only
+    image = None
+    if reduced_decode and str(image_path).lower().endswith(JPEG_EXTENSIONS):
+        try:
+            source_size = read_jpeg_size(image_path)
+        except OSError:
+            source_size = None
+        factor = reduction_factor(source_size, width, height, MAX_REDUCTION) if source_size else 1
+        if factor > 1:
+            image = cv2.imread(image_path, REDUCED_COLOR_FLAGS[factor])
+            # The EXIF orientation can swap width and height after the header was read, decode in full if it got too small
+            if image is not None and (image.shape[1] < width or image.shape[0] < height):
+                image = None
+    if image is None:
+        image = cv2.imread(image_path)
+    if image is None:
+        print(f"Error: No image found at {image_path}")
+        return None
+    return cv2.resize(image, (width, height))
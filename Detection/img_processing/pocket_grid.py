@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+from debug_sink import display_image
+import cnn_code_path
+from chip_predictor import load_class_indices, inverse_class_indices
+
+# Input size of the chip CNNs (train_CNN_cate_RGB.py / train_CNN_cate_Gray.py)
+POCKET_SIZE = 224
+
+# Cell size (pixels) of one pocket in the resized tray, so that the pocket without its margins is exactly `size`
+def pocket_cell_size(size, pocket_margin):
+    margin = int(round(size * pocket_margin / (1 - 2 * pocket_margin)))
+    return size + 2 * margin, margin
+
+# Inner area of the warped tray holding the pockets, tray_margin = (top, right, bottom, left) as fractions of the tray
+def pocket_area(tray_shape, tray_margin=(0, 0, 0, 0)):
+    height, width = tray_shape[:2]
+    top, right, bottom, left = tray_margin
+    x0, y0 = int(round(width * left)), int(round(height * top))
+    x1, y1 = width - int(round(width * right)), height - int(round(height * bottom))
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"Tray margins {tray_margin} leave no pocket area")
+    return x0, y0, x1, y1
+
+# Rectangles (rows, cols, 4) of x, y, w, h of every pocket (without its margin) in warped tray coordinates
+def pocket_boxes(tray_shape, rows, cols, tray_margin=(0, 0, 0, 0), pocket_margin=0.0):
+    x0, y0, x1, y1 = pocket_area(tray_shape, tray_margin)
+    cell_width, cell_height = (x1 - x0) / cols, (y1 - y0) / rows
+    xs = x0 + np.arange(cols) * cell_width + cell_width * pocket_margin
+    ys = y0 + np.arange(rows) * cell_height + cell_height * pocket_margin
+    boxes = np.empty((rows, cols, 4), dtype=np.int32)
+    boxes[:, :, 0] = np.round(xs)[None, :]
+    boxes[:, :, 1] = np.round(ys)[:, None]
+    boxes[:, :, 2] = int(round(cell_width * (1 - 2 * pocket_margin)))
+    boxes[:, :, 3] = int(round(cell_height * (1 - 2 * pocket_margin)))
+    return boxes
+
+# Slice the warped tray (BGR) into a (rows * cols, size, size, channels) batch of pockets, row by row
+# The pocket area is resized once so that every cell is exactly one pocket plus its margins, then the grid is cut with
+# reshape/transpose views, no per-pocket crop or resize
+# color_mode 'rgb' or 'grayscale' gives the same channels as keras load_img in classify_*_CNN_cate.py,
+# interpolation defaults to nearest like load_img(target_size=...)
+def slice_pockets(warped_tray, rows, cols, tray_margin=(0, 0, 0, 0), pocket_margin=0.0, size=POCKET_SIZE,
+                  color_mode='rgb', interpolation=cv2.INTER_NEAREST):
+    if not 0 <= pocket_margin < 0.5:
+        raise ValueError("pocket_margin must be in [0, 0.5)")
+    x0, y0, x1, y1 = pocket_area(warped_tray.shape, tray_margin)
+    cell, margin = pocket_cell_size(size, pocket_margin)
+    area = cv2.resize(warped_tray[y0:y1, x0:x1], (cols * cell, rows * cell), interpolation=interpolation)
+    if color_mode == 'rgb':
+        area = cv2.cvtColor(area, cv2.COLOR_BGR2RGB)
+    elif color_mode == 'grayscale':
+        area = cv2.cvtColor(area, cv2.COLOR_BGR2GRAY)[:, :, None]
+    else:
+        raise ValueError(f"Unknown color_mode {color_mode!r}, use 'rgb' or 'grayscale'")
+    channels = area.shape[2]
+    # (rows * cell, cols * cell, C) -> (rows, cell, cols, cell, C) -> (rows, cols, cell, cell, C)
+    grid = area.reshape(rows, cell, cols, cell, channels).transpose(0, 2, 1, 3, 4)
+    pockets = grid[:, :, margin:margin + size, margin:margin + size]
+    return np.ascontiguousarray(pockets).reshape(rows * cols, size, size, channels)
+
+# Classify every pocket of the warped tray with one model call
+# model is a loaded Keras model (or anything with predict_on_batch, or a callable returning an array)
+# rescale multiplies the pixels before the call: make_prediction feeds raw 0-255 values (default 1.0),
+# use 1/255 to match the ImageDataGenerator(rescale=1./255) of the training scripts
+# Returns the class map (rows, cols) of class names and the probabilities (rows, cols, classes)
+def classify_tray(warped_tray, model, class_names, rows, cols, tray_margin=(0, 0, 0, 0), pocket_margin=0.0,
+                  color_mode='rgb', rescale=1.0, stats=None):
+    start_time = time.perf_counter()
+    batch = slice_pockets(warped_tray, rows, cols, tray_margin, pocket_margin, color_mode=color_mode).astype(np.float32)
+    if rescale != 1.0:
+        batch *= rescale
+    slice_seconds = time.perf_counter() - start_time
+
+    predict = getattr(model, 'predict_on_batch', None) or model
+    probabilities = np.asarray(predict(batch)).reshape(rows, cols, -1)
+    class_map = np.asarray(class_names, dtype=object)[np.argmax(probabilities, axis=2)]
+    if stats is not None:
+        stats['slice_seconds'] = slice_seconds
+        stats['predict_seconds'] = time.perf_counter() - start_time - slice_seconds
+        stats['pockets'] = rows * cols
+    return class_map, probabilities
+
+# Draw the pocket grid and the class of every pocket on a copy of the warped tray
+def draw_pocket_grid(warped_tray, boxes, class_map=None, colors=None):
+    output_image = warped_tray.copy()
+    colors = colors or {}
+    for row in range(boxes.shape[0]):
+        for col in range(boxes.shape[1]):
+            x, y, w, h = boxes[row, col].tolist()
+            label = None if class_map is None else class_map[row, col]
+            color = colors.get(label, (0, 0, 255))
+            cv2.rectangle(output_image, (x, y), (x + w, y + h), color, 1)
+            if label is not None:
+                cv2.putText(output_image, str(label)[:6], (x + 2, y + h - 3), cv2.FONT_HERSHEY_SIMPLEX, 0.3, color, 1)
+    return output_image
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Split a warped tray into its pocket grid and classify every pocket in one CNN call.")
+    parser.add_argument('tray_image', help="Warped tray image (e.g. a tray crop written by batch_process.py --crops-dir)")
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--cols', type=int, required=True)
+    parser.add_argument('--tray-margin', type=float, nargs=4, default=(0, 0, 0, 0), metavar=('TOP', 'RIGHT', 'BOTTOM', 'LEFT'),
+                        help="Border of the tray without pockets, as fractions of the tray size")
+    parser.add_argument('--pocket-margin', type=float, default=0.0, help="Border of every pocket left out, as a fraction of the pocket")
+    parser.add_argument('--model', default='CNN_code/best_rgb_chip_model_cate.keras')
+    parser.add_argument('--class-indices', default='CNN_code/chip_rgb_class_indices.pkl')
+    parser.add_argument('--grayscale', action='store_true', help="The model is the grayscale CNN")
+    parser.add_argument('--rescale', type=float, default=1.0, help="Pixel scale before the model (1/255 = training scale)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    tray_image = cv2.imread(args.tray_image)
+    if tray_image is None:
+        print(f"Error: No image found at {args.tray_image}")
+        return 1
+
+    # TensorFlow is only needed by this example, the slicing above works without it
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf                                     # type: ignore
+    model = tf.keras.models.load_model(args.model)
+    class_names = inverse_class_indices(load_class_indices(args.class_indices))     # ordered by model output index
+
+    stats = {}
+    class_map, probabilities = classify_tray(tray_image, model, class_names, args.rows, args.cols,
+                                             tuple(args.tray_margin), args.pocket_margin,
+                                             'grayscale' if args.grayscale else 'rgb', args.rescale, stats)
+    print(f"{stats['pockets']} pockets: slicing {stats['slice_seconds'] * 1000:.1f} ms, "
+          f"one model call {stats['predict_seconds'] * 1000:.1f} ms")
+    for row in class_map:
+        print(' '.join(f"{label:>12}" for label in row))
+    boxes = pocket_boxes(tray_image.shape, args.rows, args.cols, tuple(args.tray_margin), args.pocket_margin)
+    display_image(draw_pocket_grid(tray_image, boxes, class_map), "Pocket classes")
+    return 0
+
+# Example: python pocket_grid.py crops/tray4_tray0.png --rows 12 --cols 8 --pocket-margin 0.1
+if __name__ == "__main__":
+    sys.exit(main())
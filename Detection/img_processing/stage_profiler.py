@@ -0,0 +1,166 @@
+import os
+import csv
+import json
+import time
+import heapq
+import marshal
+import cProfile
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Records wall time, CPU time and (optionally) peak allocation of every pipeline stage
+#   recorder = StageRecorder(track_memory=True, profile_slowest=5)
+#   with recorder.profile_image('tray (4).jpg'):
+#       with recorder.stage('load'):
+#           image = load_image(path)
+# track_memory uses tracemalloc (numpy/OpenCV arrays are tracked) and slows the pipeline down, so it is off by default
+# profile_slowest=N runs every image under cProfile and keeps the profiles of the N slowest images
+class StageRecorder:
+    def __init__(self, track_memory=False, profile_slowest=0):
+        self.track_memory = track_memory
+        self.profile_slowest = profile_slowest
+        self.records = []
+        self.current_image = None
+        self.slowest_profiles = []     # min-heap of (seconds, order, image, stats)
+        self.profile_count = 0
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # Time one stage of the current image (nested stages share the tracemalloc peak, so keep them flat)
+    @contextmanager
+    def stage(self, name):
+        if self.track_memory:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            record = {
+                'image': self.current_image,
+                'stage': name,
+                'wall_seconds': time.perf_counter() - wall_start,
+                'cpu_seconds': time.process_time() - cpu_start,
+                'peak_bytes': None,
+            }
+            if self.track_memory:
+                record['peak_bytes'] = max(0, tracemalloc.get_traced_memory()[1] - memory_start)
+            self.records.append(record)
+
+    # Decorator version of stage(), e.g. @recorder.timed('tray')
+    def timed(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Mark every stage inside the block as belonging to image_id, profile the image if profile_slowest is set
+    @contextmanager
+    def profile_image(self, image_id):
+        self.current_image = image_id
+        profiler = cProfile.Profile() if self.profile_slowest > 0 else None
+        wall_start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.create_stats()
+                self.add_profile(image_id, time.perf_counter() - wall_start, profiler.stats)
+            self.current_image = None
+
+    # Keep the cProfile stats of the image if it is one of the slowest profile_slowest images
+    def add_profile(self, image_id, seconds, stats):
+        if self.profile_slowest <= 0:
+            return
+        self.profile_count += 1
+        entry = (seconds, self.profile_count, image_id, stats)
+        if len(self.slowest_profiles) < self.profile_slowest:
+            heapq.heappush(self.slowest_profiles, entry)
+        elif seconds > self.slowest_profiles[0][0]:
+            heapq.heapreplace(self.slowest_profiles, entry)
+
+    # Add records measured somewhere else (e.g. in a worker process)
+    def merge(self, records):
+        self.records.extend(records)
+
+    # Wall seconds per stage of one image, e.g. {'load': 0.02, 'barcode': 0.05}
+    def stage_times(self, image_id=None):
+        return {record['stage']: round(record['wall_seconds'], 6) for record in self.records if record['image'] == image_id}
+
+    # Count, total, mean, max and percentiles of every stage over the run
+    def summary(self):
+        stages = {}
+        for record in self.records:
+            stages.setdefault(record['stage'], []).append(record)
+        summary = {}
+        for name, records in stages.items():
+            wall = np.array([record['wall_seconds'] for record in records])
+            cpu = np.array([record['cpu_seconds'] for record in records])
+            stage_summary = {
+                'count': len(records),
+                'wall_total': float(wall.sum()),
+                'wall_mean': float(wall.mean()),
+                'wall_max': float(wall.max()),
+                'cpu_total': float(cpu.sum()),
+            }
+            for percentile in PERCENTILES:
+                stage_summary[f'wall_p{percentile}'] = float(np.percentile(wall, percentile))
+                stage_summary[f'cpu_p{percentile}'] = float(np.percentile(cpu, percentile))
+            peaks = [record['peak_bytes'] for record in records if record['peak_bytes'] is not None]
+            if peaks:
+                stage_summary['peak_bytes_max'] = int(max(peaks))
+                stage_summary['peak_bytes_p95'] = float(np.percentile(peaks, 95))
+            summary[name] = stage_summary
+        return summary
+
+    def export_json(self, path, include_records=True):
+        data = {'summary': self.summary()}
+        if include_records:
+            data['records'] = self.records
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+    # One row per stage, or one row per record with per_record=True
+    def export_csv(self, path, per_record=False):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            if per_record:
+                writer = csv.DictWriter(f, fieldnames=['image', 'stage', 'wall_seconds', 'cpu_seconds', 'peak_bytes'])
+                writer.writeheader()
+                writer.writerows(self.records)
+                return
+            summary = self.summary()
+            fieldnames = ['stage'] + sorted({key for stage_summary in summary.values() for key in stage_summary})
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            for name, stage_summary in summary.items():
+                writer.writerow(dict(stage_summary, stage=name))
+
+    # Write the kept profiles as .prof files (open them with pstats or snakeviz), slowest first
+    def dump_profiles(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for rank, (seconds, _, image_id, stats) in enumerate(sorted(self.slowest_profiles, reverse=True), start=1):
+            name = os.path.splitext(os.path.basename(str(image_id)))[0] or 'image'
+            path = os.path.join(directory, f"{rank:02d}_{name}.prof")
+            with open(path, 'wb') as f:
+                marshal.dump(stats, f)
+            paths.append(path)
+        return paths
+
+    def print_summary(self):
+        for name, stage_summary in self.summary().items():
+            print(f"{name:>14}: n={stage_summary['count']:<5} p50={stage_summary['wall_p50'] * 1000:8.1f} ms"
+                  f"  p95={stage_summary['wall_p95'] * 1000:8.1f} ms  max={stage_summary['wall_max'] * 1000:8.1f} ms"
+                  f"  cpu p50={stage_summary['cpu_p50'] * 1000:8.1f} ms")
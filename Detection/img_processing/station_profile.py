@@ -0,0 +1,61 @@
+import os
+import json
+
+# Calibration profile of one station (camera + lighting), written by calibrate_station.py
+# A profile only stores the values that differ from the defaults of the detectors, one section per stage:
+#   {"name": "line2", "tray": {"hsv_ranges": [[[0, 0, 70], [180, 40, 200]], ...], "blur_sigma": 2}, "substrate": {...}}
+# The detectors call stage_settings() with their own defaults, so an empty profile keeps the hand-tuned behaviour
+# The profile is loaded once at startup from the DETECTION_PROFILE environment variable (a name in PROFILE_DIR or a
+# path to a .json file), or later with set_profile()
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'station_profiles')
+STAGES = ('barcode', 'tray', 'substrate')
+
+active_profile = {'name': 'default'}
+
+# Path of a profile given by name (stored in PROFILE_DIR) or by path
+def profile_path(name_or_path):
+    if name_or_path.endswith('.json') or os.sep in name_or_path:
+        return name_or_path
+    return os.path.join(PROFILE_DIR, f"{name_or_path}.json")
+
+def load_profile(name_or_path):
+    path = profile_path(name_or_path)
+    with open(path, encoding='utf-8') as f:
+        profile = json.load(f)
+    unknown = set(profile) - set(STAGES) - {'name', 'created', 'calibration'}
+    if unknown:
+        raise ValueError(f"Unknown sections {sorted(unknown)} in profile {path}")
+    profile.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    return profile
+
+def save_profile(profile, name_or_path=None):
+    path = profile_path(name_or_path or profile['name'])
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    return path
+
+# Use a profile (dict, name or path) for every following detection, None goes back to the defaults
+def set_profile(profile):
+    global active_profile
+    if profile is None:
+        profile = {'name': 'default'}
+    elif isinstance(profile, str):
+        profile = load_profile(profile)
+    active_profile = profile
+    return active_profile
+
+def get_profile():
+    return active_profile
+
+# Settings of one stage: the detector defaults overridden by the stage section of the profile (active profile if None)
+def stage_settings(stage, defaults, profile=None):
+    profile = active_profile if profile is None else profile
+    overrides = profile.get(stage, {})
+    unknown = set(overrides) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown {stage} settings {sorted(unknown)} in profile {profile.get('name')}")
+    return dict(defaults, **overrides)
+
+if os.environ.get('DETECTION_PROFILE'):
+    set_profile(os.environ['DETECTION_PROFILE'])
@@ -0,0 +1,258 @@
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+import cv2
+import numpy as np
+from frame_cache import Frame, rotate_image_quarter
+from stage_profiler import StageRecorder
+from debug_sink import set_debug_mode
+from get_barcode_n_image_rotated import get_barcode, find_barcode_polygon
+from get_tray_reduced_process import get_tray, find_polygons, TRAY_SETTINGS
+from station_profile import stage_settings
+from warp_perspective_for_cropped_img import order_points
+
+THUMBNAIL_SIZE = (160, 90)      # size of the grayscale thumbnail used to measure the motion between frames
+
+# 4 corners (top-left, top-right, bottom-right, bottom-left) of any polygon, from its minimum area rectangle if not 4-sided
+def polygon_corners(polygon):
+    points = polygon.reshape(-1, 2).astype("float32")
+    if len(points) != 4:
+        points = cv2.boxPoints(cv2.minAreaRect(points))
+    return order_points(points)
+
+# Bounding rectangle of the polygon expanded by margin (fraction of its size, at least min_margin pixels), clipped to the image
+def expanded_roi(polygon, image_shape, margin=0.25, min_margin=20):
+    x, y, w, h = cv2.boundingRect(polygon)
+    dx, dy = max(min_margin, int(w * margin)), max(min_margin, int(h * margin))
+    height, width = image_shape[:2]
+    x0, y0 = max(0, x - dx), max(0, y - dy)
+    x1, y1 = min(width, x + w + dx), min(height, y + h + dy)
+    return x0, y0, x1, y1
+
+# 0/255 mask of one HSV range on the region (x0, y0, x1, y1) of the image, with the brightening and blur of get_tray
+# (computed on a few more pixels on every side so the blur sees the same neighbours as on the whole frame)
+def region_range_mask(image, region, hsv_range, settings):
+    x0, y0, x1, y1 = region
+    padding = int(np.ceil(3 * settings['blur_sigma'])) + 1
+    height, width = image.shape[:2]
+    px0, py0, px1, py1 = max(0, x0 - padding), max(0, y0 - padding), min(width, x1 + padding), min(height, y1 + padding)
+    hsv_image = Frame(image[py0:py1, px0:px1]).blurred_brightened_hsv((0, 0), settings['blur_sigma'],
+                                                                      value=settings['brightness'])
+    lower, upper = hsv_range
+    mask = cv2.inRange(hsv_image, np.array(lower), np.array(upper))
+    return mask[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+# Tray and barcode tracking on a video stream (frames already resized like load_image does)
+#   tracker = TrayTracker(barcode_areas=(5000, 100000), tray_min_area=50000)
+#   rotated_image, barcode_polygon, tray_polygon = tracker.update(frame_image, stats)
+# Every frame goes through the cheapest step that gives a valid result:
+#   static  -> the frame barely changed since the last detection, the last polygons are reused as is
+#   tracked -> the barcode is searched only in an expanded region around its last polygon, the tray only in a band
+#              around its last outline (see track_tray), with the HSV range of the last full detection
+#              (the inside of the band is filled as tray, so only the band goes through the colour conversions and blur);
+#              the result is kept if its area and corners did not move more than the tolerances from the last full detection
+#   full    -> full frame get_barcode + get_tray (first frame, lost track, validation failed, or redetect_interval frames
+#              since the last full detection, static frames included)
+#   lost    -> the full search found nothing, the next frame starts with a full search again
+# stats (optional dict) receives 'tracking' (one of the modes above) and 'motion'
+class TrayTracker:
+    def __init__(self, barcode_areas=(5000, 100000), tray_min_area=50000, epsilon_factor=0.02, roi_margin=0.25,
+                 area_tolerance=0.15, max_corner_drift=25.0, motion_threshold=2.0, redetect_interval=30,
+                 band_margin=20):
+        self.barcode_min_area, self.barcode_max_area = barcode_areas
+        self.tray_min_area = tray_min_area
+        self.epsilon_factor = epsilon_factor
+        self.roi_margin = roi_margin
+        self.area_tolerance = area_tolerance            # allowed relative area change of a tracked polygon
+        self.max_corner_drift = max_corner_drift        # allowed corner movement (pixels) of a tracked polygon
+        self.motion_threshold = motion_threshold        # mean gray level change under which a frame counts as static
+        self.redetect_interval = redetect_interval      # frames after which a full detection is forced (0 = never)
+        self.band_margin = band_margin                  # pixels of the tray band beyond corner drift + epsilon
+        self.reset()
+
+    # Forget the track, the next frame is searched on the full image
+    def reset(self):
+        self.quarter_turns = None
+        self.barcode_polygon = None
+        self.tray_polygon = None
+        self.keyframe_thumbnail = None
+        # Polygons of the last full detection, the tracked polygons are validated against them so errors do not add up
+        self.detected_barcode_polygon = None
+        self.detected_tray_polygon = None
+        self.tray_hsv_range = None                      # HSV range (lower, upper) that found the tray in the last detection
+        self.frames_since_detection = 0
+
+    def thumbnail(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+    # True if the new polygon has about the same area and corners as the detected one
+    def is_consistent(self, old_polygon, new_polygon):
+        old_area, new_area = cv2.contourArea(old_polygon), cv2.contourArea(new_polygon)
+        if old_area <= 0 or abs(new_area / old_area - 1) > self.area_tolerance:
+            return False
+        drift = np.linalg.norm(polygon_corners(old_polygon) - polygon_corners(new_polygon), axis=1)
+        return drift.max() <= self.max_corner_drift
+
+    # Search the barcode and the tray only around their last position in the rotated frame
+    def track(self, frame):
+        x0, y0, x1, y1 = expanded_roi(self.barcode_polygon, frame.image.shape, self.roi_margin)
+        barcode_polygon = find_barcode_polygon(Frame(frame.image[y0:y1, x0:x1]), self.barcode_min_area,
+                                               self.barcode_max_area)
+        if barcode_polygon is None:
+            return None
+        barcode_polygon = barcode_polygon + np.array([x0, y0], dtype=barcode_polygon.dtype)
+        if not self.is_consistent(self.detected_barcode_polygon, barcode_polygon):
+            return None
+
+        tray_polygon = self.track_tray(frame.image)
+        if tray_polygon is None or not self.is_consistent(self.detected_tray_polygon, tray_polygon):
+            return None
+        return barcode_polygon, tray_polygon
+
+    # Search the tray outline in a band around its last position: a valid polygon stays within max_corner_drift of it and
+    # its contour within epsilon (the approxPolyDP tolerance) of the polygon, so the mask is only computed on the four
+    # strips of the band and the inside is filled as tray (find_polygons only keeps external contours)
+    def track_tray(self, image):
+        settings = stage_settings('tray', TRAY_SETTINGS)
+        epsilon = self.epsilon_factor * cv2.arcLength(self.tray_polygon, True)
+        band = int(np.ceil(self.max_corner_drift + epsilon)) + self.band_margin
+        x0, y0, x1, y1 = expanded_roi(self.tray_polygon, image.shape, margin=0, min_margin=band)
+        top_left, top_right, bottom_right, bottom_left = polygon_corners(self.tray_polygon)
+        ix0 = min(x1, max(x0, int(max(top_left[0], bottom_left[0])) + band))
+        ix1 = max(ix0, min(x1, int(min(top_right[0], bottom_right[0])) - band))
+        iy0 = min(y1, max(y0, int(max(top_left[1], top_right[1])) + band))
+        iy1 = max(iy0, min(y1, int(min(bottom_left[1], bottom_right[1])) - band))
+
+        mask = np.full((y1 - y0, x1 - x0), 255, dtype=np.uint8)
+        strips = [(x0, y0, x1, iy0), (x0, iy1, x1, y1), (x0, iy0, ix0, iy1), (ix1, iy0, x1, iy1)]
+        for sx0, sy0, sx1, sy1 in strips:
+            if sx1 > sx0 and sy1 > sy0:
+                mask[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = region_range_mask(image, (sx0, sy0, sx1, sy1),
+                                                                                self.tray_hsv_range, settings)
+        tray_polygons = find_polygons(None, mask, self.tray_min_area, self.epsilon_factor,
+                                      settings['canny_lower'], settings['canny_upper'])
+        if not tray_polygons:
+            return None
+        tray_polygon = max(tray_polygons, key=cv2.contourArea)
+        return tray_polygon + np.array([x0, y0], dtype=tray_polygon.dtype)
+
+    # Full frame detection, the frame is rotated in place by get_barcode
+    # Returns (quarter_turns, barcode_polygon, tray_polygon, HSV range that found the tray) or None
+    def detect(self, frame):
+        stats = {}
+        _, barcode_polygon, _ = get_barcode(frame, self.barcode_min_area, self.barcode_max_area, crop=False, stats=stats)
+        if barcode_polygon is None:
+            return None
+        _, tray_polygons = get_tray(frame, self.tray_min_area, self.epsilon_factor, stats=stats)
+        if not tray_polygons:
+            return None
+        hsv_range = stage_settings('tray', TRAY_SETTINGS)['hsv_ranges'][stats['tray_hsv_range']]
+        return stats['quarter_turns'], barcode_polygon, max(tray_polygons, key=cv2.contourArea), hsv_range
+
+    # Process one frame and return (rotated_image, barcode_polygon, tray_polygon), polygons are None when lost
+    def update(self, image, stats=None):
+        thumbnail = self.thumbnail(image)
+        motion = None
+        self.frames_since_detection += 1
+        due = self.redetect_interval and self.frames_since_detection >= self.redetect_interval
+        if self.tray_polygon is not None and not due:
+            motion = float(cv2.absdiff(thumbnail, self.keyframe_thumbnail).mean())
+            rotated_image = rotate_image_quarter(image, self.quarter_turns)
+            mode = 'static'
+            if motion > self.motion_threshold:
+                tracked = self.track(Frame(rotated_image))
+                mode = 'tracked'
+                if tracked is None:
+                    mode = None
+                else:
+                    self.barcode_polygon, self.tray_polygon = tracked
+                    self.keyframe_thumbnail = thumbnail
+            if mode is not None:
+                if stats is not None:
+                    stats.update(tracking=mode, motion=motion)
+                return rotated_image, self.barcode_polygon, self.tray_polygon
+
+        # No track yet, the tracked result was rejected or a full detection is due: search the whole frame
+        frame = Frame(image.copy())
+        detected = self.detect(frame)
+        if detected is None:
+            self.reset()
+            mode = 'lost'
+        else:
+            self.quarter_turns, self.barcode_polygon, self.tray_polygon, self.tray_hsv_range = detected
+            self.detected_barcode_polygon, self.detected_tray_polygon = self.barcode_polygon, self.tray_polygon
+            self.keyframe_thumbnail = thumbnail
+            self.frames_since_detection = 0
+            mode = 'full'
+        if stats is not None:
+            stats.update(tracking=mode, motion=motion)
+        return frame.image, self.barcode_polygon, self.tray_polygon
+
+# Open a camera index ("0") or a video file
+def open_capture(source):
+    return cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Track the tray and barcode on a camera stream or a video file.")
+    parser.add_argument('source', help="Camera index (e.g. 0) or video file")
+    parser.add_argument('--no-tracking', action='store_true', help="Full frame detection on every frame (for comparison)")
+    parser.add_argument('--max-frames', type=int, default=0, help="Stop after this many frames (0 = whole stream)")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--roi-margin', type=float, default=0.25, help="Region of interest around the last polygons (fraction of their size)")
+    parser.add_argument('--max-corner-drift', type=float, default=25.0, help="Pixels a tracked corner may move from the last full detection")
+    parser.add_argument('--redetect-interval', type=int, default=30, help="Force a full detection after this many frames (0 = never)")
+    parser.add_argument('--motion-threshold', type=float, default=2.0, help="Mean gray level change below which the last polygons are reused")
+    parser.add_argument('--display', action='store_true', help="Show the tracked polygons (press q to stop)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    set_debug_mode('off')
+    capture = open_capture(args.source)
+    if not capture.isOpened():
+        print(f"Error: cannot open {args.source}")
+        return 1
+
+    tracker = TrayTracker(roi_margin=args.roi_margin, max_corner_drift=args.max_corner_drift,
+                          motion_threshold=args.motion_threshold, redetect_interval=args.redetect_interval)
+    recorder = StageRecorder()
+    modes = {}
+    frame_count = 0
+    start_time = time.time()
+    while not args.max_frames or frame_count < args.max_frames:
+        ok, image = capture.read()
+        if not ok:
+            break
+        image = cv2.resize(image, (args.width, args.height))
+        stats = {}
+        # The detectors print every fallback, keep the per-frame output quiet
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), recorder.stage('detect'):
+            if args.no_tracking:
+                tracker.reset()
+            rotated_image, barcode_polygon, tray_polygon = tracker.update(image, stats)
+        modes[stats['tracking']] = modes.get(stats['tracking'], 0) + 1
+        frame_count += 1
+
+        if args.display:
+            if tray_polygon is not None:
+                cv2.polylines(rotated_image, [tray_polygon], isClosed=True, color=(0, 0, 255), thickness=2)
+                cv2.polylines(rotated_image, [barcode_polygon], isClosed=True, color=(0, 255, 0), thickness=2)
+            cv2.imshow("Tray tracking", rotated_image)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    capture.release()
+    if args.display:
+        cv2.destroyAllWindows()
+
+    print(f"{frame_count} frames in {time.time() - start_time:.2f} seconds: {modes}")
+    recorder.print_summary()
+    return 0
+
+# Example: python tray_tracker.py 0 --display, or python tray_tracker.py tray_video.mp4 --no-tracking to compare
+if __name__ == "__main__":
+    sys.exit(main())
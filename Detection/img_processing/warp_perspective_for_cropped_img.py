@@ -1,28 +1,7 @@
 import cv2
 import numpy as np
-
-def display_image(image, window_name="Image"):
-    if image is not None:
-        # Create a resizable window
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-        
-        # Resize window to a fixed dimension (e.g., 1280x720)
-        cv2.resizeWindow(window_name, 1280, 720)
-        
-        # Display the image
-        cv2.imshow(window_name, image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print("No image to display.")
-
-def load_image(image_path, width=1280, height=720):
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"Error: No image found at {image_path}")
-        return None
-    resized_image = cv2.resize(image, (width, height))
-    return resized_image
+from debug_sink import display_image
+from image_loader import load_image
 
 def order_points(pts):
     # Initialize a list of coordinates that will be ordered as follows:
@@ -43,6 +22,38 @@ def order_points(pts):
 
     return rect
 
+# Warp the area inside the 4 ordered points (top-left, top-right, bottom-right, bottom-left) into a rectangle
+def warp_points_to_rectangle(image, src_pts):
+    # Define destination points for warping to fit the entire image size
+    maxWidth = int(max(np.linalg.norm(src_pts[0] - src_pts[1]), np.linalg.norm(src_pts[2] - src_pts[3])))
+    maxHeight = int(max(np.linalg.norm(src_pts[0] - src_pts[3]), np.linalg.norm(src_pts[1] - src_pts[2])))
+    maxWidth, maxHeight = max(maxWidth, 1), max(maxHeight, 1)
+
+    dst_pts = np.array([
+        [0, 0],
+        [maxWidth - 1, 0],
+        [maxWidth - 1, maxHeight - 1],
+        [0, maxHeight - 1]
+    ], dtype="float32")
+
+    # Calculate the perspective transformation matrix
+    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
+
+    # Apply warp perspective to fit the detected object into a rectangle
+    return cv2.warpPerspective(image, M, (maxWidth, maxHeight))
+
+# Rectify a polygon found by get_barcode/find_polygons directly from the full image with one warpPerspective
+# (no mask, no crop and no second contour search, so the unwarped crop is never returned)
+def warp_polygon_to_rectangle(image, polygon):
+    points = polygon.reshape(-1, 2).astype("float32")
+    if len(points) != 4:
+        # approxPolyDP did not give 4 corners, use the corners of the minimum area rectangle around the polygon
+        points = cv2.boxPoints(cv2.minAreaRect(points))
+
+    # Order points to ensure consistent orientation
+    src_pts = order_points(points)
+    return warp_points_to_rectangle(image, src_pts)
+
 def warp_perspective_to_fit_object(cropped_image):
     # Convert the image to grayscale
     gray = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2GRAY)
@@ -75,22 +86,8 @@ def warp_perspective_to_fit_object(cropped_image):
             cv2.circle(cropped_image, (int(point[0]), int(point[1])), 1, (0, 0, 255), -1)
         '''display_image(cropped_image, "Detected Corners on Image")  # Display corners on image'''
 
-        # Define destination points for warping to fit the entire image size
-        maxWidth = int(max(np.linalg.norm(src_pts[0] - src_pts[1]), np.linalg.norm(src_pts[2] - src_pts[3])))
-        maxHeight = int(max(np.linalg.norm(src_pts[0] - src_pts[3]), np.linalg.norm(src_pts[1] - src_pts[2])))
-        
-        dst_pts = np.array([
-            [0, 0],
-            [maxWidth - 1, 0],
-            [maxWidth - 1, maxHeight - 1],
-            [0, maxHeight - 1]
-        ], dtype="float32")
-
-        # Calculate the perspective transformation matrix
-        M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-
-        # Apply warp perspective to fit the detected object into a rectangle
-        warped_image = cv2.warpPerspective(cropped_image, M, (maxWidth, maxHeight))
+        # Warp the detected object into a rectangle that fits the entire image size
+        warped_image = warp_points_to_rectangle(cropped_image, src_pts)
         '''display_image(warped_image, "Warped Image Fitting the Object to Full Frame")  # Display the warped image'''
     else:
         print("Detected contour does not have 4 corners. Cannot apply warp perspective.")
@@ -2,23 +2,10 @@ import cv2
 import numpy as np
 import time
 
-# Display an image in a resizable window
-def display_image(image, window_name="Image"):
-    if image is not None:
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-        cv2.imshow(window_name, image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print(f"No image to display for {window_name}.")
-
-# Load an image from the specified path and return it
-def load_image(image_path, width=1280, height=720):
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"Error: No image found at {image_path}")
-        return None
-    return cv2.resize(image, (width, height))
+# The image loader and the debug images are shared with img_processing (DETECTION_DEBUG=off|disk|interactive)
+import img_processing_path
+from debug_sink import display_image
+from image_loader import load_image
 
 # Draw bounding square on the largest detected contour
 def bounding_box(image, min_area, max_area):
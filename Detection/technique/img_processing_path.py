@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Makes the shared img_processing modules (image_loader, debug_sink, ...) importable from the technique scripts,
+# import it before them:
+#   import img_processing_path
+#   from image_loader import load_image
+IMG_PROCESSING_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'img_processing'))
+if IMG_PROCESSING_DIR not in sys.path:
+    sys.path.append(IMG_PROCESSING_DIR)
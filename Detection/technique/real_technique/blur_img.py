@@ -1,21 +1,10 @@
 import cv2
 import numpy as np
 
-# Display an image in a resizable window
-def display_image(image, window_name="Image"):
-    
-    # Ensure if there is an image in the path directory
-    if image is not None:
-        # Create a named window with the ability to resize
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-        
-        # Display the image with the specified window name
-        cv2.imshow(window_name, image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print("No image to display.")
-        
+# The debug images go through the shared sink of img_processing (DETECTION_DEBUG=off|disk|interactive)
+import img_processing_path
+from debug_sink import display_image
+
 # Load an image from the specified path and return it.
 def load_image(image_path, width=1280, height=720):
     # Load the image
@@ -0,0 +1,5 @@
+import os
+import runpy
+
+# Same as technique/img_processing_path.py (which holds the path) for the scripts of this folder
+runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'img_processing_path.py'))
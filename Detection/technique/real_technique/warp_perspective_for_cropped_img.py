@@ -1,28 +1,10 @@
 import cv2
 import numpy as np
 
-def display_image(image, window_name="Image"):
-    if image is not None:
-        # Create a resizable window
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-        
-        # Resize window to a fixed dimension (e.g., 1280x720)
-        cv2.resizeWindow(window_name, 1280, 720)
-        
-        # Display the image
-        cv2.imshow(window_name, image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print("No image to display.")
-
-def load_image(image_path, width=1280, height=720):
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"Error: No image found at {image_path}")
-        return None
-    resized_image = cv2.resize(image, (width, height))
-    return resized_image
+# The image loader and the debug images are shared with img_processing (DETECTION_DEBUG=off|disk|interactive)
+import img_processing_path
+from debug_sink import display_image
+from image_loader import load_image
 
 def order_points(pts):
     # Initialize a list of coordinates that will be ordered as follows:
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# The detection scripts import each other by module name from their own folder (they are run from there),
+# the tests put both folders on the path the same way
+DETECTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('img_processing', 'CNN_code'):
+    path = os.path.join(DETECTION_DIR, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# No debug window may open while the tests run
+os.environ['DETECTION_DEBUG'] = 'off'
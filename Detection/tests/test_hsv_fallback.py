@@ -0,0 +1,57 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from hsv_fallback import build_range_bits, first_accepted_range, range_mask
+
+HSV_RANGES = [
+    ((0, 0, 60), (180, 60, 180)),
+    ((0, 0, 60), (180, 60, 140)),
+    ((0, 0, 60), (180, 20, 180)),
+    ((10, 50, 0), (30, 255, 255)),
+]
+
+def random_hsv(seed=0):
+    rng = np.random.default_rng(seed)
+    hsv = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    hsv[..., 0] %= 181
+    return hsv
+
+def test_range_masks_equal_in_range():
+    hsv = random_hsv()
+    range_bits = build_range_bits(hsv, HSV_RANGES)
+    for index, (lower, upper) in enumerate(HSV_RANGES):
+        assert np.array_equal(range_mask(range_bits, index), cv2.inRange(hsv, np.array(lower), np.array(upper)))
+
+# Index of the range that produced the mask, found back from the pixel count
+def range_of(mask, hsv):
+    counts = [cv2.countNonZero(cv2.inRange(hsv, np.array(lower), np.array(upper))) for lower, upper in HSV_RANGES]
+    return counts.index(cv2.countNonZero(mask))
+
+# The earlier ranges finish last: the winner must still be the first accepted range in list order, on every run
+@pytest.mark.parametrize('max_workers', [None, 1, 2, 4])
+def test_first_accepted_range_is_deterministic(max_workers):
+    hsv = random_hsv(1)
+    accepted = {1, 3}
+    def evaluate(mask):
+        index = range_of(mask, hsv)
+        time.sleep(0.01 * (len(HSV_RANGES) - index))
+        return index
+    for _ in range(3):
+        assert first_accepted_range(hsv, HSV_RANGES, evaluate, lambda index: index in accepted, max_workers) == (1, 1)
+
+def test_first_accepted_range_without_accepted_range_returns_last_result():
+    hsv = random_hsv(2)
+    result = first_accepted_range(hsv, HSV_RANGES, lambda mask: range_of(mask, hsv), lambda index: False, max_workers=4)
+    assert result == (None, len(HSV_RANGES) - 1)
+
+def test_first_accepted_range_sequential_stops_at_first_accepted():
+    hsv = random_hsv(3)
+    evaluated = []
+    def evaluate(mask):
+        evaluated.append(range_of(mask, hsv))
+        return evaluated[-1]
+    assert first_accepted_range(hsv, HSV_RANGES, evaluate, lambda index: index >= 1, max_workers=1) == (1, 1)
+    assert evaluated == [0, 1]
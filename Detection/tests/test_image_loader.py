@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+import pytest
+
+import image_loader
+from image_loader import load_image, read_jpeg_size, reduction_factor
+
+def write_jpeg(path, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    # Smooth content so the reduced and the full decode are comparable
+    image = cv2.resize(rng.integers(0, 256, (9, 16, 3), dtype=np.uint8), (width, height), interpolation=cv2.INTER_LINEAR)
+    assert cv2.imwrite(str(path), image)
+    return image
+
+@pytest.mark.parametrize('width, height', [(1280, 720), (4000, 3000), (33, 17)])
+def test_read_jpeg_size(tmp_path, width, height):
+    path = tmp_path / 'image.jpg'
+    write_jpeg(path, width, height)
+    assert read_jpeg_size(str(path)) == (width, height)
+
+def test_read_jpeg_size_skips_fill_bytes(tmp_path):
+    data = bytearray(cv2.imencode('.jpg', np.zeros((30, 40, 3), dtype=np.uint8))[1].tobytes())
+    data[2:2] = b'\xff\xff'                 # fill bytes before the first marker after SOI
+    path = tmp_path / 'filled.jpg'
+    path.write_bytes(bytes(data))
+    assert read_jpeg_size(str(path)) == (40, 30)
+
+def test_read_jpeg_size_of_other_files_is_none(tmp_path):
+    png_path = tmp_path / 'image.png'
+    cv2.imwrite(str(png_path), np.zeros((10, 10, 3), dtype=np.uint8))
+    truncated_path = tmp_path / 'truncated.jpg'
+    truncated_path.write_bytes(cv2.imencode('.jpg', np.zeros((30, 40, 3), dtype=np.uint8))[1].tobytes()[:20])
+    assert read_jpeg_size(str(png_path)) is None
+    assert read_jpeg_size(str(truncated_path)) is None
+
+def test_reduction_factor():
+    assert reduction_factor((10240, 5760), 1280, 720) == 8
+    assert reduction_factor((5120, 2880), 1280, 720) == 4
+    assert reduction_factor((4000, 3000), 1280, 720) == 2
+    assert reduction_factor((2000, 1500), 1280, 720) == 1
+    assert reduction_factor((1280, 720), 1280, 720) == 1
+    assert reduction_factor((10240, 5760), 1280, 720, max_factor=2) == 2
+
+def test_reduced_decode_matches_full_decode(tmp_path):
+    path = tmp_path / 'large.jpg'
+    write_jpeg(path, 2560, 1440)
+    reduced = load_image(str(path), 1280, 720, reduced_decode=True)
+    full = load_image(str(path), 1280, 720)
+    assert reduced.shape == full.shape == (720, 1280, 3)
+    assert np.abs(reduced.astype(np.int16) - full).mean() < 2.0
+
+# A reduced decode smaller than the target (e.g. rotated by its EXIF orientation) is decoded again in full
+def test_reduced_decode_too_small_falls_back_to_full_decode(tmp_path, monkeypatch):
+    path = tmp_path / 'large.jpg'
+    write_jpeg(path, 2560, 1440)
+    imread = cv2.imread
+    flags = []
+    def rotated_imread(image_path, flag=cv2.IMREAD_COLOR):
+        flags.append(flag)
+        image = imread(image_path, flag)
+        return np.ascontiguousarray(np.rot90(image)) if flag != cv2.IMREAD_COLOR else image
+    monkeypatch.setattr(image_loader.cv2, 'imread', rotated_imread)
+    image = load_image(str(path), 1280, 720, reduced_decode=True)
+    assert flags == [cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_COLOR]
+    assert image.shape == (720, 1280, 3)
+
+def recorded_imread_flags(monkeypatch):
+    imread = cv2.imread
+    flags = []
+    def recording_imread(image_path, flag=cv2.IMREAD_COLOR):
+        flags.append(flag)
+        return imread(image_path, flag)
+    monkeypatch.setattr(image_loader.cv2, 'imread', recording_imread)
+    return flags
+
+# Reduced decode is opt-in, and never reduces by more than MAX_REDUCTION
+def test_full_decode_by_default(tmp_path, monkeypatch):
+    path = tmp_path / 'large.jpg'
+    write_jpeg(path, 2560, 1440)
+    flags = recorded_imread_flags(monkeypatch)
+    load_image(str(path), 1280, 720)
+    assert flags == [cv2.IMREAD_COLOR]
+
+def test_reduced_decode_is_capped(tmp_path, monkeypatch):
+    path = tmp_path / 'huge.jpg'
+    write_jpeg(path, 5120, 2880)
+    flags = recorded_imread_flags(monkeypatch)
+    image = load_image(str(path), 1280, 720, reduced_decode=True)
+    assert flags == [image_loader.REDUCED_COLOR_FLAGS[image_loader.MAX_REDUCTION]]
+    assert image.shape == (720, 1280, 3)
+
+# A file named .jpg without a readable JPEG header is decoded in full
+def test_unreadable_header_falls_back_to_full_decode(tmp_path):
+    path = tmp_path / 'really_a_png.jpg'
+    cv2.imwrite(str(tmp_path / 'image.png'), np.full((800, 1600, 3), 128, dtype=np.uint8))
+    path.write_bytes((tmp_path / 'image.png').read_bytes())
+    image = load_image(str(path), 320, 180)
+    assert image.shape == (180, 320, 3)
+    assert int(image[0, 0, 0]) == 128
+
+def test_missing_image_is_none(tmp_path):
+    assert load_image(str(tmp_path / 'missing.jpg')) is None
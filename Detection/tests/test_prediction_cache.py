@@ -0,0 +1,101 @@
+import pickle
+
+import numpy as np
+
+import model_registry
+from prediction_cache import CachedModel, PredictionCache, crop_hash
+
+def probabilities(value):
+    return np.array([value, 1 - value], dtype=np.float32)
+
+def test_lru_eviction_drops_the_least_recently_used_entry():
+    cache = PredictionCache(max_entries=2)
+    cache.put('model', 'a', probabilities(0.1))
+    cache.put('model', 'b', probabilities(0.2))
+    assert cache.get('model', 'a') is not None      # 'a' is now the most recently used
+    cache.put('model', 'c', probabilities(0.3))
+    assert cache.get('model', 'b') is None
+    assert cache.get('model', 'a') is not None and cache.get('model', 'c') is not None
+    stats = cache.stats()
+    assert (stats['entries'], stats['evictions'], stats['hits'], stats['misses']) == (2, 1, 3, 1)
+
+def test_other_identity_invalidates_the_entries():
+    cache = PredictionCache()
+    cache.put('model-1', 'a', probabilities(0.1))
+    assert cache.get('model-2', 'a') is None
+    assert len(cache) == 0
+    assert cache.stats()['invalidations'] == 1
+    cache.check_identity('model-2')                 # same identity, nothing to drop
+    assert cache.stats()['invalidations'] == 1
+
+def test_saved_entries_are_loaded_for_the_same_identity_only(tmp_path):
+    path = str(tmp_path / 'predictions.npz')
+    cache = PredictionCache(path=path)
+    cache.put('model-1', 'a', probabilities(0.25))
+    cache.save()
+    loaded = PredictionCache(path=path)
+    assert np.allclose(loaded.get('model-1', 'a'), probabilities(0.25))
+    assert PredictionCache(path=path).get('model-2', 'a') is None
+
+class CountingModel:
+    input_shape = (None, 4, 4, 1)
+    output_shape = (None, 2)
+
+    def __init__(self):
+        self.predicted = 0
+
+    def predict_on_batch(self, batch):
+        self.predicted += len(batch)
+        return np.stack([probabilities(float(crop.mean()) / 255) for crop in batch])
+
+class StubChipModel:
+    def __init__(self, identity):
+        self.identity = identity
+        self.model = CountingModel()
+        self.predictor = CountingModel()
+
+    def low_latency(self, max_batch_size=1):
+        return self.predictor
+
+def test_cached_model_only_predicts_missing_crops():
+    chip_model = StubChipModel('model-1')
+    cached_model = CachedModel(chip_model, PredictionCache())
+    batch = np.stack([np.full((4, 4, 1), value, dtype=np.float32) for value in (0, 51, 102)])
+    first = cached_model.predict_on_batch(batch)
+    second = cached_model.predict_on_batch(batch[::-1])
+    assert chip_model.model.predicted == 3
+    assert np.array_equal(second, first[::-1])
+    assert cached_model.predict_on_batch(batch[:0]).shape == (0, 2)
+
+def test_cached_model_uses_the_low_latency_predictor():
+    chip_model = StubChipModel('model-1')
+    cached_model = CachedModel(chip_model, PredictionCache(), max_batch_size=1)
+    cached_model.predict(np.zeros((1, 4, 4, 1), dtype=np.float32))
+    assert (chip_model.predictor.predicted, chip_model.model.predicted) == (1, 0)
+
+def test_crop_hash_depends_on_shape_and_type():
+    crop = np.zeros((4, 4, 1), dtype=np.float32)
+    assert crop_hash(crop) == crop_hash(crop.copy())
+    assert crop_hash(crop) != crop_hash(crop.reshape(4, 1, 4))
+    assert crop_hash(crop) != crop_hash(crop.astype(np.float64))
+
+# reload_model of an unchanged model file gives another identity, so the cached predictions are dropped
+def test_reload_model_invalidates_the_cache(tmp_path, monkeypatch):
+    model_path = tmp_path / 'model.keras'
+    model_path.write_bytes(b'weights')
+    class_indices_path = tmp_path / 'class_indices.pkl'
+    class_indices_path.write_bytes(pickle.dumps({'chip': 0, 'empty': 1}))
+    monkeypatch.setattr(model_registry, 'load_model', lambda path: CountingModel())
+    monkeypatch.setattr(model_registry, 'models', {})
+    monkeypatch.setattr(model_registry, 'load_counts', {})
+
+    chip_model = model_registry.get_model('rgb', str(model_path), str(class_indices_path))
+    assert model_registry.get_model('rgb', str(model_path), str(class_indices_path)) is chip_model
+    cache = PredictionCache()
+    cache.put(chip_model.identity, 'crop', probabilities(0.5))
+
+    reloaded = model_registry.reload_model('rgb', str(model_path), str(class_indices_path))
+    assert reloaded is not chip_model
+    assert reloaded.identity != chip_model.identity
+    assert cache.get(reloaded.identity, 'crop') is None
+    assert cache.stats()['invalidations'] == 1
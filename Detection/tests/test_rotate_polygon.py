@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+import pytest
+
+from frame_cache import rotate_image_quarter
+from get_barcode_n_image_rotated import rotate_polygon_quarter
+
+WIDTH, HEIGHT = 64, 40
+POLYGON = np.array([[[5, 3]], [[40, 7]], [[38, 30]], [[2, 25]]], dtype=np.int32)
+
+# The rotated polygon must cover exactly the pixels of the polygon drawn before the image was rotated with cv2.rotate
+# (axis-aligned edges, fillPoly does not rasterize a sloped edge the same way once rotated)
+@pytest.mark.parametrize('quarter_turns', [0, 1, 2, 3, 4, 5])
+def test_rotate_polygon_quarter_matches_cv2_rotate(quarter_turns):
+    polygon = np.array([[[5, 3]], [[40, 3]], [[40, 30]], [[5, 30]]], dtype=np.int32)
+    mask = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    cv2.fillPoly(mask, [polygon], 255)
+    rotated_mask = rotate_image_quarter(mask, quarter_turns)
+
+    rotated_polygon = rotate_polygon_quarter(polygon, quarter_turns, WIDTH, HEIGHT)
+    expected = np.zeros_like(rotated_mask)
+    cv2.fillPoly(expected, [rotated_polygon], 255)
+    assert np.array_equal(rotated_mask, expected)
+
+# Every corner lands on the pixel cv2.rotate moves it to
+@pytest.mark.parametrize('quarter_turns', [1, 2, 3])
+def test_rotate_polygon_quarter_moves_every_corner_with_its_pixel(quarter_turns):
+    for x, y in POLYGON.reshape(-1, 2):
+        image = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        image[y, x] = 255
+        rotated_y, rotated_x = np.argwhere(rotate_image_quarter(image, quarter_turns))[0]
+        point = np.array([[[x, y]]], dtype=np.int32)
+        assert rotate_polygon_quarter(point, quarter_turns, WIDTH, HEIGHT).reshape(2).tolist() == [rotated_x, rotated_y]
+
+def test_rotate_polygon_quarter_keeps_shape_and_type():
+    rotated = rotate_polygon_quarter(POLYGON, 1, WIDTH, HEIGHT)
+    assert rotated.shape == POLYGON.shape
+    assert rotated.dtype == POLYGON.dtype
@@ -0,0 +1,66 @@
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from get_substrate_from_tray import component_boxes, contour_boxes, find_bounding_boxes
+
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'labelImg_xml_and_crop', 'Trays_and_annotate_all')
+
+def sorted_boxes(boxes):
+    return sorted(map(tuple, np.asarray(boxes).reshape(-1, 4).tolist()))
+
+# Squares, a ring with a square inside its hole, blobs touching only by a corner and an area on the image border
+def synthetic_mask():
+    mask = np.zeros((200, 300), dtype=np.uint8)
+    cv2.rectangle(mask, (10, 10), (40, 42), 255, -1)
+    cv2.rectangle(mask, (60, 60), (140, 140), 255, -1)
+    cv2.rectangle(mask, (75, 75), (125, 125), 0, -1)
+    cv2.rectangle(mask, (90, 90), (110, 110), 255, -1)     # inside the hole of the ring, not an outer area
+    cv2.rectangle(mask, (160, 20), (180, 40), 255, -1)
+    cv2.rectangle(mask, (181, 41), (200, 60), 255, -1)     # 8-connected to the previous square
+    cv2.circle(mask, (250, 150), 30, 255, -1)
+    cv2.rectangle(mask, (0, 170), (30, 199), 255, -1)
+    return mask
+
+def random_mask(seed):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random((120, 160)) < 0.3, 255, 0).astype(np.uint8)
+
+@pytest.mark.parametrize('mask', [synthetic_mask(), random_mask(0), random_mask(1)], ids=['synthetic', 'noise0', 'noise1'])
+def test_component_boxes_equal_contour_boxes(mask):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes, areas = component_boxes(mask)
+    assert sorted_boxes(boxes) == sorted_boxes(contour_boxes(contours))
+    assert len(areas) == len(boxes)
+
+def test_contour_boxes_equal_bounding_rect():
+    contours, _ = cv2.findContours(synthetic_mask(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    assert contour_boxes(contours).tolist() == [list(cv2.boundingRect(contour)) for contour in contours]
+    assert contour_boxes([]).shape == (0, 4)
+
+@pytest.mark.parametrize('min_size', [0, 15, 40])
+def test_find_bounding_boxes_finders_agree(min_size):
+    mask = synthetic_mask()
+    contour_result = find_bounding_boxes(None, mask, min_size, min_size, finder='contours')
+    component_result = find_bounding_boxes(None, mask, min_size, min_size, finder='components')
+    assert sorted_boxes(contour_result) == sorted_boxes(component_result)
+
+# Same substrates from both finders on the gray masks of the annotated trays
+@pytest.mark.skipif(not os.path.isdir(DATASET), reason="annotated tray images not available")
+def test_find_bounding_boxes_finders_agree_on_tray_masks():
+    from get_tray_reduced_process import TRAY_HSV_RANGES
+    from image_loader import load_image
+    for image_path in sorted(glob.glob(os.path.join(DATASET, '*.jpg')))[:10]:
+        hsv = cv2.cvtColor(load_image(image_path), cv2.COLOR_BGR2HSV)
+        lower, upper = TRAY_HSV_RANGES[0]
+        mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
+        contour_result = find_bounding_boxes(None, mask, 20, 20, finder='contours')
+        component_result = find_bounding_boxes(None, mask, 20, 20, finder='components')
+        assert sorted_boxes(contour_result) == sorted_boxes(component_result), image_path
+
+def test_find_bounding_boxes_rejects_unknown_finder():
+    with pytest.raises(ValueError):
+        find_bounding_boxes(None, synthetic_mask(), 0, 0, finder='blobs')